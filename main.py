@@ -16,61 +16,257 @@ Execution Modes:
 """
 
 import os
+import re
 import sys
 import time
 import json
-import pickle
-import subprocess
-import traceback
 import argparse
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 from urllib.parse import urlparse, parse_qs
-from dotenv import load_dotenv
 
-# Selenium imports for browser automation
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+    _dumps_pretty = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    _loads = json.loads
+    _dumps = lambda obj: json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    _dumps_pretty = lambda obj: json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
 
-# PyQt5 imports
-from PyQt5.QtWidgets import QApplication
+# Selenium, PyQt5, dotenv and the chat UI are imported inside the functions
+# that use them, so --auth-only never loads Qt and --chat-only never loads
+# Selenium; traceback is likewise only imported where needed
 
 # Add src to path for imports
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
-from src.ui.main_window import TelegramChatWindow
-from src.api.bitrix_api import BitrixAPI
+from src.auth.env_handler import write_file_atomic
 
 
 # ============================================================================
 # SECTION 1: CHROME AUTHENTICATION APPLICATION
 # ============================================================================
 
+# Skip first-run UI, sync, component updates and other background work
+# that a one-shot auth browser never needs
+_CHROME_STARTUP_ARGS = (
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-default-apps",
+    "--disable-component-update",
+    "--disable-breakpad",
+    "--disable-ipc-flooding-protection",
+    "--disable-renderer-backgrounding",
+    "--disable-backgrounding-occluded-windows",
+    "--metrics-recording-only",
+    "--mute-audio",
+    "--disable-features=Translate,MediaRouter",
+)
+
+# Browser-side lookups, shared by the single-purpose helpers on ChromeAuthApp
+# and by snapshot_browser_state, which runs them all in one round-trip
+_CSRF_JS = """
+var csrf = document.querySelector('meta[name="x-bitrix-csrf-token"]');
+var csrf_value = csrf ? csrf.getAttribute('content') : null;
+
+if (!csrf_value && typeof BX !== 'undefined') {
+    csrf_value = BX.message('bitrix_sessid');
+}
+
+if (!csrf_value && typeof window.bitrix_sessid !== 'undefined') {
+    csrf_value = window.bitrix_sessid;
+}
+
+var site_id = 'ap';
+var site_meta = document.querySelector('meta[name="x-bitrix-site-id"]');
+if (site_meta) {
+    site_id = site_meta.getAttribute('content');
+}
+
+return {csrf: csrf_value, site_id: site_id};
+"""
+
+_USER_ID_JS = """
+var user_id = null;
+
+if (typeof BX !== 'undefined' && typeof BX.User !== 'undefined') {
+    if (typeof BX.User.getId === 'function') {
+        user_id = BX.User.getId();
+    }
+}
+
+if (!user_id && typeof BX !== 'undefined' && BX.user_id) {
+    user_id = BX.user_id;
+}
+
+if (!user_id) {
+    var cookies = document.cookie.split(';');
+    for (var i = 0; i < cookies.length; i++) {
+        var cookie = cookies[i].trim();
+        if (cookie.indexOf('UID=') === 0) {
+            user_id = parseInt(cookie.substring(4));
+            break;
+        }
+    }
+}
+
+if (!user_id) {
+    user_id = 2611;
+}
+
+return user_id;
+"""
+
+_LOCAL_STORAGE_JS = """
+var items = {};
+for (var i = 0; i < localStorage.length; i++) {
+    var key = localStorage.key(i);
+    var value = localStorage.getItem(key);
+
+    // Only save Bitrix-related items to avoid storing too much data
+    if (key.toLowerCase().includes('bitrix') || 
+        key.toLowerCase().includes('bx') ||
+        key.includes('USER') ||
+        key.includes('SESSION') ||
+        key.includes('AUTH')) {
+        items[key] = value;
+    }
+}
+return items;
+"""
+
+_SESSION_STORAGE_JS = """
+var items = {};
+for (var i = 0; i < sessionStorage.length; i++) {
+    var key = sessionStorage.key(i);
+    var value = sessionStorage.getItem(key);
+
+    if (key.toLowerCase().includes('bitrix') || 
+        key.toLowerCase().includes('bx') ||
+        key.includes('USER') ||
+        key.includes('SESSION')) {
+        items[key] = value;
+    }
+}
+return items;
+"""
+
+_COOKIE_CHECK_JS = """
+var bitrix_cookies = {};
+var session_cookies = {};
+
+// One pass over document.cookie, classifying each cookie into both buckets
+var cookies = document.cookie.split(';');
+for (var i = 0; i < cookies.length; i++) {
+    var cookie = cookies[i].trim();
+    var eq = cookie.indexOf('=');
+    var name = eq === -1 ? cookie : cookie.substring(0, eq);
+    var value = eq === -1 ? '' : cookie.substring(eq + 1);
+    if (/^(BITRIX_|UID)/.test(name)) {
+        bitrix_cookies[name] = value;
+    }
+    if (/SESSID|SESSION/.test(name)) {
+        session_cookies[name] = value;
+    }
+}
+
+return {
+    'bitrix_cookies': bitrix_cookies,
+    'session_cookies': session_cookies,
+};
+"""
+
+def _optional_js(script, fallback):
+    """Wrap a snippet so an exception yields `fallback` instead of failing the whole script"""
+    return "(function() { try {" + script + "} catch (e) { return " + fallback + "; } })()"
+
+
+# CSRF and user ID are required; the storage reads and cookie check are
+# optional extras and must not abort the snapshot if they throw
+_SNAPSHOT_JS = (
+    "var state = (function() {" + _CSRF_JS + "})();\n"
+    "state.user_id = (function() {" + _USER_ID_JS + "})();\n"
+    "state.local_storage = " + _optional_js(_LOCAL_STORAGE_JS, "{}") + ";\n"
+    "state.session_storage = " + _optional_js(_SESSION_STORAGE_JS, "{}") + ";\n"
+    "state.cookie_check = " + _optional_js(_COOKIE_CHECK_JS, "{bitrix_cookies: {}, session_cookies: {}}") + ";\n"
+    "state.user_agent = navigator.userAgent;\n"
+    "state.url = location.href;\n"
+    "return state;"
+)
+
+
+# getTokenApi via fetch for execute_async_script; resolves with the parsed response
+_TOKEN_REQUEST_JS = """
+var csrf = arguments[0];
+var site_id = arguments[1];
+var done = arguments[arguments.length - 1];
+
+fetch('/bitrix/services/main/ajax.php?action=me%3Abase.api.user.getTokenApi', {
+    method: 'POST',
+    credentials: 'include',
+    keepalive: true,
+    headers: {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'x-bitrix-csrf-token': csrf,
+        'x-bitrix-site-id': site_id,
+        'bx-ajax': 'true'
+    },
+    body: ''
+}).then(function(r) { return r.text(); }).then(function(text) {
+    try { done(JSON.parse(text)); } catch (e) { done({error: 'Parse error', raw: text}); }
+}).catch(function(e) { done({error: String(e)}); });
+"""
+
+
 class ChromeAuthApp:
     """Browser automation for Bitrix24 authentication"""
     
-    def __init__(self, headless=False):
+    def __init__(self, headless=False, profile_dir=None):
+        # Selenium imports for browser automation
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        
         self.chrome_options = Options()
         
+        # Persistent profile so cookies and storage survive between runs
+        self.profile_dir = Path(profile_dir) if profile_dir else Path.home() / '.chatbitrix_chrome_profile'
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.chrome_options.add_argument(f"--user-data-dir={self.profile_dir}")
+        self.chrome_options.add_argument("--profile-directory=Default")
+        
         if not headless:
             self.chrome_options.add_argument("--start-maximized")
         else:
             self.chrome_options.add_argument("--headless")
+            # Nobody looks at the page in headless mode
+            self.chrome_options.add_argument("--blink-settings=imagesEnabled=false")
         
+        # driver.get() returns at DOMContentLoaded instead of waiting for
+        # every image, tracker and font on the page
+        self.chrome_options.page_load_strategy = 'eager'
         self.chrome_options.add_argument("--disable-notifications")
         self.chrome_options.add_argument("--disable-popup-blocking")
+        for arg in _CHROME_STARTUP_ARGS:
+            self.chrome_options.add_argument(arg)
         self.chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         self.chrome_options.add_experimental_option('useAutomationExtension', False)
         
         self.driver = webdriver.Chrome(options=self.chrome_options)
-        self.wait = WebDriverWait(self.driver, 10)
+        # Explicit WebDriverWait is the only element timeout; an implicit wait
+        # would be added to every element lookup those waits make
+        self.driver.implicitly_wait(0)
+        # Upper bound for execute_async_script calls such as the token request
+        self.driver.set_script_timeout(30)
         
         self.tokens = {}
         self.csrf_tokens = {}
         self.target_url = "https://ugautodetal.ru/?login=yes"
+        # BITRIX_DEBUG=1 turns on diagnostic output such as the cookie report
+        self.debug = os.environ.get('BITRIX_DEBUG') == '1'
         self.url_watch_active = False
     
     def navigate_to_login(self, url):
@@ -78,56 +274,72 @@ class ChromeAuthApp:
         self.driver.get(url)
         return self.driver.current_url
     
-    def watch_for_target_url(self, timeout=300, check_interval=2):
+    def watch_for_target_url(self, timeout=300, check_interval=0.25):
         """Watch for the target URL to appear"""
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
+        
         print(f"\n" + "="*60)
         print(f"WATCHING FOR TARGET URL")
         print(f"Target: {self.target_url}")
         print(f"Timeout: {timeout} seconds")
         print(f"="*60)
         
-        start_time = time.time()
+        start_time = time.monotonic()
+        next_log = start_time + 10
         self.url_watch_active = True
         
-        while time.time() - start_time < timeout:
-            current_url = self.driver.current_url
-            target_normalized = self.target_url.rstrip('/')
-            current_normalized = current_url.rstrip('/')
-            
-            if target_normalized == current_normalized:
-                print(f"\n✅ TARGET URL DETECTED!")
-                print(f"   Current URL: {current_url}")
-                print(f"   Target URL: {self.target_url}")
-                self.url_watch_active = False
-                return True
+        target_normalized = self.target_url.rstrip('/')
+        last_seen_url = None
+        
+        def on_target(driver):
+            nonlocal next_log, last_seen_url
+            current_url = driver.current_url
+            if current_url.rstrip('/') == target_normalized:
+                return current_url
             
-            if "" in current_url.lower() or "" in current_url.lower():
+            if current_url != last_seen_url:
                 print(f"   🔍 On login page: {current_url}")
+            last_seen_url = current_url
             
-            elapsed = int(time.time() - start_time)
-            if elapsed % 10 == 0:
-                print(f"   ⏱️  Watching... {elapsed}s elapsed (timeout: {timeout}s)")
+            if time.monotonic() >= next_log:
+                print(f"   ⏱️  Watching... {int(time.monotonic() - start_time)}s elapsed (timeout: {timeout}s)")
                 print(f"   Current URL: {current_url}")
-            
-            time.sleep(check_interval)
+                next_log += 10
+            return False
         
-        print(f"\n❌ TIMEOUT - Target URL not detected within {timeout} seconds")
-        print(f"   Last URL: {self.driver.current_url}")
-        self.url_watch_active = False
-        return False
+        try:
+            current_url = WebDriverWait(self.driver, timeout, poll_frequency=check_interval).until(on_target)
+        except TimeoutException:
+            print(f"\n❌ TIMEOUT - Target URL not detected within {timeout} seconds")
+            print(f"   Last URL: {last_seen_url}")
+            return False
+        finally:
+            self.url_watch_active = False
+        
+        print(f"\n✅ TARGET URL DETECTED!")
+        print(f"   Current URL: {current_url}")
+        print(f"   Target URL: {self.target_url}")
+        return True
     
-    def wait_for_login_completion(self, timeout=120, check_interval=2):
+    def wait_for_login_completion(self, timeout=120, check_interval=0.25):
         """Wait for login to complete by watching for URL changes"""
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
+        
+        last_url = self.driver.current_url
+        
         print(f"\n" + "="*60)
         print(f"WAITING FOR LOGIN COMPLETION")
-        print(f"Starting URL: {self.driver.current_url}")
+        print(f"Starting URL: {last_url}")
         print(f"="*60)
         
-        start_time = time.time()
-        last_url = self.driver.current_url
+        start_time = time.monotonic()
+        next_log = start_time + 10
         
-        while time.time() - start_time < timeout:
-            current_url = self.driver.current_url
+        def login_completed(driver):
+            nonlocal next_log, last_url
+            current_url = driver.current_url
             
             if current_url != last_url:
                 print(f"   🔄 URL changed: {current_url}")
@@ -135,53 +347,35 @@ class ChromeAuthApp:
             
             # Check if we're off the login page
             if "?login=yes" in current_url and "login" in current_url.lower():
-                print(f"\n✅ LOGIN COMPLETED!")
-                print(f"   Current URL: {current_url}")
-                return True
-            
-            elapsed = int(time.time() - start_time)
-            if elapsed % 10 == 0:
-                print(f"   ⏱️  Waiting... {elapsed}s elapsed (timeout: {timeout}s)")
+                return current_url
             
-            time.sleep(check_interval)
+            if time.monotonic() >= next_log:
+                print(f"   ⏱️  Waiting... {int(time.monotonic() - start_time)}s elapsed (timeout: {timeout}s)")
+                next_log += 10
+            return False
         
-        print(f"\n❌ TIMEOUT - Still on login page after {timeout} seconds")
-        return False
+        try:
+            current_url = WebDriverWait(self.driver, timeout, poll_frequency=check_interval).until(login_completed)
+        except TimeoutException:
+            print(f"\n❌ TIMEOUT - Still on login page after {timeout} seconds")
+            return False
+        
+        print(f"\n✅ LOGIN COMPLETED!")
+        print(f"   Current URL: {current_url}")
+        return True
     
-    def check_bitrix_cookies(self):
-        """Check for Bitrix authentication cookies"""
+    def check_bitrix_cookies(self, state=None, browser_cookies=None):
+        """
+        Check for Bitrix authentication cookies
+        
+        Reuses the cookie check of a snapshot_browser_state result and an
+        already fetched get_cookies() list when given.
+        """
         print("\n" + "="*60)
         print("CHECKING BITRIX AUTHENTICATION COOKIES")
         print("="*60)
         
-        check_cookie_js = """
-        var cookies = document.cookie.split(';');
-        var bitrix_cookies = {};
-        
-        for (var i = 0; i < cookies.length; i++) {
-            var cookie = cookies[i].trim();
-            if (cookie.indexOf('BITRIX_') === 0 || cookie.indexOf('UID') === 0) {
-                var parts = cookie.split('=');
-                bitrix_cookies[parts[0]] = parts[1] || '';
-            }
-        }
-        
-        var session_cookies = {};
-        for (var i = 0; i < cookies.length; i++) {
-            var cookie = cookies[i].trim();
-            if (cookie.indexOf('SESSID') !== -1 || cookie.indexOf('SESSION') !== -1) {
-                var parts = cookie.split('=');
-                session_cookies[parts[0]] = parts[1] || '';
-            }
-        }
-        
-        return {
-            'bitrix_cookies': bitrix_cookies,
-            'session_cookies': session_cookies,
-        };
-        """
-        
-        cookies_data = self.driver.execute_script(check_cookie_js)
+        cookies_data = state['cookie_check'] if state is not None else self.driver.execute_script(_COOKIE_CHECK_JS)
         bitrix_cookies = cookies_data.get('bitrix_cookies', {})
         
         print("\n1. Bitrix Cookies Found:")
@@ -191,7 +385,7 @@ class ChromeAuthApp:
         else:
             print("   ❌ No Bitrix cookies found")
         
-        selenium_cookies = self.driver.get_cookies()
+        selenium_cookies = browser_cookies if browser_cookies is not None else self.driver.get_cookies()
         bitrix_selenium = [c for c in selenium_cookies if 'BITRIX' in c['name'].upper()]
         
         print("\n2. Selenium Cookie Check:")
@@ -203,71 +397,124 @@ class ChromeAuthApp:
         
         print("\n" + "="*60)
     
+    def has_live_session(self):
+        """
+        True if the browser is off the login page and holds the Bitrix login cookie
+        
+        Only a hint: the cookie can outlive the server-side session, so
+        get_api_token_in_browser falls back to the login flow if the token
+        request then fails.
+        """
+        if "login=yes" in self.driver.current_url:
+            return False
+        return any(cookie['name'].upper() == 'BITRIX_SM_UIDL' for cookie in self.driver.get_cookies())
+    
     def get_api_token_in_browser(self):
         """Main method: Get token after login completes"""
         print("\n" + "="*60)
         print("BITRIX24 API TOKEN ACQUISITION")
         print("="*60)
         
+        reused_session = self.has_live_session()
+        if reused_session:
+            # The persistent profile may still be logged in from a previous run
+            print("\n✅ Login cookie present, trying the existing browser session")
+        elif not self._login_interactively():
+            return None, None
+        
+        token, user_id = self._acquire_token()
+        
+        if not token and reused_session:
+            # The cookie outlived the server-side session; log in again
+            # instead of failing the same way on every run
+            print("\n⚠️  Saved session looks expired, falling back to manual login")
+            self.driver.get(self.target_url)
+            if not self._login_interactively():
+                return None, None
+            token, user_id = self._acquire_token()
+        
+        return token, user_id
+    
+    def _login_interactively(self):
+        """Wait for the login page and for the user to log in; False on timeout"""
         print("\n1. Waiting for login page...")
         if not self.watch_for_target_url(timeout=300):
             print("❌ Failed to reach login page")
-            return None, None
+            return False
         
         print("\n2. Waiting for login completion...")
         print("   Please log in manually in the browser window...")
         
         if not self.wait_for_login_completion(timeout=180):
             print("❌ Login timeout")
-            return None, None
+            return False
+        return True
+    
+    def _acquire_token(self):
+        """Read the CSRF token from the logged-in page, request the API token and save it"""
+        # One page snapshot and one cookie-jar read serve every step below
+        state = self.snapshot_browser_state()
+        browser_cookies = self.driver.get_cookies()
         
-        print("\n3. Verifying authentication...")
-        self.check_bitrix_cookies()
+        if self.debug:
+            # Diagnostic only: nothing below depends on the cookie report
+            print("\n3. Verifying authentication...")
+            self.check_bitrix_cookies(state, browser_cookies)
         
         print("\n4. Extracting CSRF token...")
-        csrf_token, site_id = self.extract_csrf_token()
+        csrf_token, site_id = self.extract_csrf_token(state)
         
         if not csrf_token:
             print("❌ Failed to extract CSRF token")
             return None, None
         
         print("\n5. Getting API token...")
-        token, user_id = self.request_api_token(csrf_token, site_id)
+        token, user_id = self.request_api_token(csrf_token, site_id, state)
         
         if token:
             print(f"\n✅ SUCCESS!")
             print(f"   Token: {token[:30]}...")
             print(f"   User ID: {user_id}")
-            self.save_token_to_file_with_storage(token, user_id, csrf_token, site_id)
+            self.save_token_to_file_with_storage(token, user_id, csrf_token, site_id, state, browser_cookies)
             return token, user_id
         else:
             print("❌ Failed to get API token")
             return None, None
     
-    def extract_csrf_token(self):
-        """Extract CSRF token and site ID from page"""
-        csrf_js = """
-        var csrf = document.querySelector('meta[name="x-bitrix-csrf-token"]');
-        var csrf_value = csrf ? csrf.getAttribute('content') : null;
-        
-        if (!csrf_value && typeof BX !== 'undefined') {
-            csrf_value = BX.message('bitrix_sessid');
-        }
-        
-        if (!csrf_value && typeof window.bitrix_sessid !== 'undefined') {
-            csrf_value = window.bitrix_sessid;
-        }
-        
-        var site_id = 'ap';
-        var site_meta = document.querySelector('meta[name="x-bitrix-site-id"]');
-        if (site_meta) {
-            site_id = site_meta.getAttribute('content');
-        }
+    def snapshot_browser_state(self):
+        """
+        Read CSRF token, site ID, user ID, Bitrix storage items, user agent
+        and URL in one execute_script call
         
-        return {csrf: csrf_value, site_id: site_id};
+        If the combined script fails, the pieces are queried one by one so
+        that a failing optional read cannot block the CSRF token.
         """
+        from selenium.common.exceptions import WebDriverException
         
-        csrf_data = self.driver.execute_script(csrf_js)
+        try:
+            return self.driver.execute_script(_SNAPSHOT_JS)
+        except WebDriverException as e:
+            print(f"   ⚠️  Combined page snapshot failed, querying step by step: {e}")
+        
+        state = self.driver.execute_script(_CSRF_JS) or {}
+        state['user_id'] = self.driver.execute_script(_USER_ID_JS)
+        state['url'] = self.driver.current_url
+        optional = (
+            ('local_storage', _LOCAL_STORAGE_JS, {}),
+            ('session_storage', _SESSION_STORAGE_JS, {}),
+            ('cookie_check', _COOKIE_CHECK_JS, {'bitrix_cookies': {}, 'session_cookies': {}}),
+            ('user_agent', "return navigator.userAgent;", ''),
+        )
+        for key, script, default in optional:
+            try:
+                state[key] = self.driver.execute_script(script)
+            except WebDriverException:
+                state[key] = default
+        return state
+    
+    def extract_csrf_token(self, state=None):
+        """Extract CSRF token and site ID from page (or from a snapshot_browser_state result)"""
+        csrf_data = state if state is not None else self.driver.execute_script(_CSRF_JS)
         csrf_token = csrf_data.get('csrf')
         site_id = csrf_data.get('site_id', 'ap')
         
@@ -279,44 +526,17 @@ class ChromeAuthApp:
         
         return csrf_token, site_id
     
-    def request_api_token(self, csrf_token, site_id):
+    def request_api_token(self, csrf_token, site_id, state=None):
         """Request API token using CSRF token"""
-        print("   Requesting token...")
-        
-        token_request_js = """
-        var csrf = arguments[0];
-        var site_id = arguments[1];
-        var url = '/bitrix/services/main/ajax.php?action=me%3Abase.api.user.getTokenApi';
-        
-        var xhr = new XMLHttpRequest();
-        xhr.withCredentials = true;
-        
-        xhr.onreadystatechange = function() {
-            if (xhr.readyState === 4) {
-                try {
-                    var data = JSON.parse(xhr.responseText);
-                    window.tokenResponse = data;
-                } catch(e) {
-                    window.tokenResponse = {error: 'Parse error', raw: xhr.responseText};
-                }
-            }
-        };
+        from selenium.common.exceptions import TimeoutException
         
-        xhr.open('POST', url, false);
-        xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
-        xhr.setRequestHeader('x-bitrix-csrf-token', csrf);
-        xhr.setRequestHeader('x-bitrix-site-id', site_id);
-        xhr.setRequestHeader('bx-ajax', 'true');
-        xhr.send('');
-        
-        return 'Token request sent';
-        """
+        print("   Requesting token...")
         
-        self.driver.execute_script(token_request_js, csrf_token, site_id)
+        try:
+            result = self.driver.execute_async_script(_TOKEN_REQUEST_JS, csrf_token, site_id)
+        except TimeoutException:
+            result = None
         
-        response_js = "return window.tokenResponse;"
-        result = self.driver.execute_script(response_js)
-
         token = None
         user_id = None
         
@@ -325,93 +545,28 @@ class ChromeAuthApp:
             user_id = result['data'].get('USER_ID')
         
         if not token:
-            user_id = self.extract_user_id()
+            user_id = self.extract_user_id(state)
         
         return token, user_id
     
-    def extract_user_id(self):
-        """Extract user ID from page"""
-        user_id_js = """
-        var user_id = null;
-        
-        if (typeof BX !== 'undefined' && typeof BX.User !== 'undefined') {
-            if (typeof BX.User.getId === 'function') {
-                user_id = BX.User.getId();
-            }
-        }
-        
-        if (!user_id && typeof BX !== 'undefined' && BX.user_id) {
-            user_id = BX.user_id;
-        }
-        
-        if (!user_id) {
-            var cookies = document.cookie.split(';');
-            for (var i = 0; i < cookies.length; i++) {
-                var cookie = cookies[i].trim();
-                if (cookie.indexOf('UID=') === 0) {
-                    user_id = parseInt(cookie.substring(4));
-                    break;
-                }
-            }
-        }
-        
-        if (!user_id) {
-            user_id = 2611;
-        }
-        
-        return user_id;
-        """
-        
-        user_id = self.driver.execute_script(user_id_js)
+    def extract_user_id(self, state=None):
+        """Extract user ID from page (or from a snapshot_browser_state result)"""
+        user_id = state['user_id'] if state is not None else self.driver.execute_script(_USER_ID_JS)
         print(f"   ✅ User ID: {user_id}")
         return user_id
     
-    def get_local_storage_data(self):
-        """Extract local storage data from browser"""
+    def get_local_storage_data(self, state=None):
+        """Extract local storage data from browser (or from a snapshot_browser_state result)"""
         print("\n6. Extracting local storage data...")
         
         try:
-            # JavaScript to get all local storage items
-            local_storage_js = """
-            var items = {};
-            for (var i = 0; i < localStorage.length; i++) {
-                var key = localStorage.key(i);
-                var value = localStorage.getItem(key);
-                
-                // Only save Bitrix-related items to avoid storing too much data
-                if (key.toLowerCase().includes('bitrix') || 
-                    key.toLowerCase().includes('bx') ||
-                    key.includes('USER') ||
-                    key.includes('SESSION') ||
-                    key.includes('AUTH')) {
-                    items[key] = value;
-                }
-            }
-            return items;
-            """
-            
-            local_storage = self.driver.execute_script(local_storage_js)
+            if state is None:
+                state = self.snapshot_browser_state()
             
+            local_storage = state['local_storage']
             print(f"   Found {len(local_storage)} Bitrix-related local storage items")
             
-            # Get some session storage items too
-            session_storage_js = """
-            var items = {};
-            for (var i = 0; i < sessionStorage.length; i++) {
-                var key = sessionStorage.key(i);
-                var value = sessionStorage.getItem(key);
-                
-                if (key.toLowerCase().includes('bitrix') || 
-                    key.toLowerCase().includes('bx') ||
-                    key.includes('USER') ||
-                    key.includes('SESSION')) {
-                    items[key] = value;
-                }
-            }
-            return items;
-            """
-            
-            session_storage = self.driver.execute_script(session_storage_js)
+            session_storage = state['session_storage']
             print(f"   Found {len(session_storage)} Bitrix-related session storage items")
             
             # Combine both
@@ -419,8 +574,8 @@ class ChromeAuthApp:
                 'local_storage': local_storage,
                 'session_storage': session_storage,
                 'timestamp': time.time(),
-                'user_agent': self.driver.execute_script("return navigator.userAgent;"),
-                'url': self.driver.current_url
+                'user_agent': state['user_agent'],
+                'url': state['url']
             }
             
             return all_storage
@@ -432,72 +587,56 @@ class ChromeAuthApp:
     def get_local_storage(self):
         """Get local storage data from .env file"""
         try:
-            env_path = Path('.env')
-            if not env_path.exists():
-                return {}
-            
-            local_storage_json = None
-            session_storage_json = None
-            
-            with open(env_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.startswith('BITRIX_LOCAL_STORAGE='):
-                        local_storage_json = line.split('=', 1)[1].strip()
-                    elif line.startswith('BITRIX_SESSION_STORAGE='):
-                        session_storage_json = line.split('=', 1)[1].strip()
+            env_values = _read_env_values(Path('.env'))
+            local_storage_json = env_values.get('BITRIX_LOCAL_STORAGE')
+            session_storage_json = env_values.get('BITRIX_SESSION_STORAGE')
             
             result = {}
             if local_storage_json:
-                result['local_storage'] = json.loads(local_storage_json)
+                result['local_storage'] = _loads(local_storage_json)
             if session_storage_json:
-                result['session_storage'] = json.loads(session_storage_json)
+                result['session_storage'] = _loads(session_storage_json)
             
             return result
         except Exception as e:
             print(f"⚠️  Could not load local storage from .env: {e}")
             return {}
     
-    def save_token_to_file_with_storage(self, token, user_id, csrf_token, site_id):
+    def save_token_to_file_with_storage(self, token, user_id, csrf_token, site_id, state=None, browser_cookies=None):
         """Save token to files (.env and JSON) with local storage"""
         try:
             # Get local storage data
-            storage_data = self.get_local_storage_data()
-            
-            # Save to .env file
-            env_path = Path('.env')
-            env_content = []
-            
-            if env_path.exists():
-                with open(env_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if not any(line.startswith(key) for key in ['BITRIX_REST_TOKEN=', 'BITRIX_USER_ID=', 
-                                                                    'BITRIX_LOCAL_STORAGE=', 'BITRIX_SESSION_STORAGE=',
-                                                                    'BITRIX_API_URL=', 'BITRIX_SITE_ID=']):
-                            env_content.append(line.rstrip())
-            
-            env_content.append(f"BITRIX_REST_TOKEN={token}")
-            env_content.append(f"BITRIX_USER_ID={user_id}")
-            env_content.append(f"BITRIX_API_URL=https://ugautodetal.ru")
-            env_content.append(f"BITRIX_SITE_ID={site_id}")
+            storage_data = self.get_local_storage_data(state)
+            
+            # Save to .env file; storage keys without data are removed
+            env_updates = {
+                'BITRIX_REST_TOKEN': token,
+                'BITRIX_USER_ID': user_id,
+                'BITRIX_API_URL': 'https://ugautodetal.ru',
+                'BITRIX_SITE_ID': site_id,
+                'BITRIX_LOCAL_STORAGE': None,
+                'BITRIX_SESSION_STORAGE': None,
+            }
             
             # Save local storage (encoded to avoid newline issues)
             if storage_data.get('local_storage'):
-                local_storage_json = json.dumps(storage_data['local_storage'], separators=(',', ':'))
-                env_content.append(f"BITRIX_LOCAL_STORAGE={local_storage_json}")
+                env_updates['BITRIX_LOCAL_STORAGE'] = _dumps(storage_data['local_storage']).decode('utf-8')
             
             # Save session storage
             if storage_data.get('session_storage'):
-                session_storage_json = json.dumps(storage_data['session_storage'], separators=(',', ':'))
-                env_content.append(f"BITRIX_SESSION_STORAGE={session_storage_json}")
+                env_updates['BITRIX_SESSION_STORAGE'] = _dumps(storage_data['session_storage']).decode('utf-8')
             
-            with open(env_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(env_content))
+            _rewrite_env(Path('.env'), env_updates)
             
             print(f"\n   ✅ Saved to .env")
             print(f"   - Token, User ID, CSRF token, Site ID")
             print(f"   - Local storage: {len(storage_data.get('local_storage', {}))} items")
             print(f"   - Session storage: {len(storage_data.get('session_storage', {}))} items")
             
+            # Reuse the caller's cookie round-trip when there is one
+            if browser_cookies is None:
+                browser_cookies = self.driver.get_cookies()
+            
             # Save to JSON file with full data
             auth_data = {
                 'token': token,
@@ -505,29 +644,17 @@ class ChromeAuthApp:
                 'csrf_token': csrf_token,
                 'site_id': site_id,
                 'storage': storage_data,
-                'cookies': self.get_cookies(),
+                'cookies': {cookie['name']: cookie['value'] for cookie in browser_cookies},
                 'timestamp': time.time()
             }
             
-            with open('bitrix_token.json', 'w', encoding='utf-8') as f:
-                json.dump(auth_data, f, indent=2, ensure_ascii=False)
+            write_file_atomic('bitrix_token.json', _dumps_pretty(auth_data))
             
             print(f"   ✅ Saved full data to bitrix_token.json")
             
-            # Also save to a pickle file for easier loading
-            with open('bitrix_auth.pkl', 'wb') as f:
-                pickle.dump({
-                    'token': token,
-                    'user_id': user_id,
-                    'cookies': self.driver.get_cookies(),
-                    'local_storage': storage_data.get('local_storage', {}),
-                    'session_storage': storage_data.get('session_storage', {})
-                }, f)
-            
-            print(f"   ✅ Saved to bitrix_auth.pkl")
-            
         except Exception as e:
             print(f"   ⚠️  Warning: Could not save all data to file: {e}")
+            import traceback
             traceback.print_exc()
     
     def get_cookies(self):
@@ -544,23 +671,85 @@ class ChromeAuthApp:
 # SECTION 2: CREDENTIAL MANAGEMENT
 # ============================================================================
 
-def check_credentials() -> Tuple[Optional[str], Optional[str]]:
-    """Check if both REST API credentials exist in .env"""
-    env_path = Path('.env')
+# BITRIX_* entries of .env, matched over the whole file in one pass
+_ENV_LINE_RE = re.compile(rb'^[ \t]*(BITRIX_[A-Z_]+)=(.*)$', re.M)
+
+
+# Parsed .env values per path, tagged with the (inode, mtime, size) they were read at
+_env_values_cache: Dict[Path, Tuple[Tuple[int, int, int], Dict[str, str]]] = {}
+
+
+def _read_env_values(env_path: Path) -> Dict[str, str]:
+    """
+    Read the BITRIX_* entries of a .env file; a later line wins over an earlier one
     
-    token = None
-    user_id = None
+    The result is cached until the file's inode, mtime or size changes, so
+    repeated lookups in one run cost a single stat. Treat it as read-only.
+    """
+    try:
+        st = env_path.stat()
+    except FileNotFoundError:
+        return {}
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _env_values_cache.get(env_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
     
-    if env_path.exists():
-        with open(env_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('BITRIX_REST_TOKEN=') and '=' in line:
-                    token = line.split('=', 1)[1].strip()
-                elif line.startswith('BITRIX_USER_ID=') and '=' in line:
-                    user_id = line.split('=', 1)[1].strip()
+    try:
+        data = env_path.read_bytes()
+    except FileNotFoundError:
+        return {}
+    values = {
+        match.group(1).decode('ascii'): match.group(2).strip().decode('utf-8')
+        for match in _ENV_LINE_RE.finditer(data)
+    }
+    _env_values_cache[env_path] = (stamp, values)
+    return values
+
+
+def _rewrite_env(env_path: Path, updates: Dict[str, Optional[object]]) -> None:
+    """
+    Set keys in a .env file with one read and one write
+    
+    Existing keys are replaced in place and new ones appended; a None value
+    removes the key. The new content goes through write_file_atomic, so
+    the .env is never left half-written and keeps its permissions;
+    nothing is written when the content would not change.
+    """
+    try:
+        original = env_path.read_bytes()
+    except FileNotFoundError:
+        original = None
+    # Split on \n only, like _ENV_LINE_RE: JSON values may hold raw U+2028
+    # and similar characters that str.splitlines() would treat as breaks
+    lines = original.decode('utf-8').split('\n') if original else []
+    if lines and not lines[-1]:
+        lines.pop()
     
-    return token, user_id
+    pending = dict(updates)
+    env_content = []
+    for line in lines:
+        key = line.split('=', 1)[0] if '=' in line else None
+        if key in updates:
+            # First occurrence takes the new value, later duplicates are dropped
+            value = pending.pop(key, None)
+            if value is not None:
+                env_content.append(f"{key}={value}")
+        else:
+            env_content.append(line.rstrip())
+    env_content.extend(f"{key}={value}" for key, value in pending.items() if value is not None)
+    
+    data = '\n'.join(env_content).encode('utf-8')
+    if data == original:
+        return
+    write_file_atomic(env_path, data)
+    _env_values_cache.pop(env_path, None)
+
+
+def check_credentials() -> Tuple[Optional[str], Optional[str]]:
+    """Check if both REST API credentials exist in .env"""
+    env_values = _read_env_values(Path('.env'))
+    return env_values.get('BITRIX_REST_TOKEN'), env_values.get('BITRIX_USER_ID')
 
 
 # ============================================================================
@@ -603,6 +792,7 @@ def run_authentication() -> Tuple[Optional[str], Optional[int]]:
         return None, None
     except Exception as e:
         print(f"\n\n❌ Error during authentication: {e}")
+        import traceback
         traceback.print_exc()
         return None, None
     finally:
@@ -620,6 +810,11 @@ def start_chat(token: str, user_id: int) -> None:
     print("="*60)
     
     try:
+        # PyQt5 and the UI/API stack are only needed once the chat starts
+        from PyQt5.QtWidgets import QApplication
+        from src.ui.main_window import TelegramChatWindow
+        from src.api.bitrix_api import BitrixAPI
+        
         # Set environment variables
         os.environ['BITRIX_REST_TOKEN'] = token
         os.environ['BITRIX_USER_ID'] = str(user_id)
@@ -655,6 +850,7 @@ def start_chat(token: str, user_id: int) -> None:
     
     except Exception as e:
         print(f"\n❌ Error starting chat application: {e}")
+        import traceback
         traceback.print_exc()
         sys.exit(1)
 
@@ -689,6 +885,7 @@ def main():
     # Chat-only mode (skip credential check)
     if args.chat_only or args.skip_credentials_check:
         print("\n⏭️  Skipping credential check (chat-only mode)...")
+        from dotenv import load_dotenv
         load_dotenv()
         token = os.getenv('BITRIX_REST_TOKEN')
         user_id_str = os.getenv('BITRIX_USER_ID')
@@ -738,5 +935,6 @@ if __name__ == "__main__":
         sys.exit(0)
     except Exception as e:
         print(f"\n\n❌ Unexpected error: {e}")
+        import traceback
         traceback.print_exc()
         sys.exit(1)
\ No newline at end of file
@@ -2,10 +2,47 @@
 Bitrix24 API client with token management and URL-based authentication
 """
 
+import copy
 import json
+import time
+import threading
 import requests
-from typing import Dict, List, Optional
-from datetime import datetime
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+    _dumps = lambda obj: json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+# Errors meaning the portal has no batch method at all
+_BATCH_MISSING_ERRORS = ('ERROR_METHOD_NOT_FOUND', 'ERROR_NOT_FOUND')
+
+
+def _build_query(params: Dict) -> str:
+    """Encode nested params PHP-style (key[sub]=value) for batch commands"""
+    pairs = []
+    
+    def walk(value, key):
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                walk(sub_value, f"{key}[{sub_key}]")
+        elif isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                walk(item, f"{key}[{index}]")
+        else:
+            pairs.append((key, int(value) if isinstance(value, bool) else value))
+    
+    for key, value in params.items():
+        walk(value, key)
+    
+    return urlencode(pairs)
 
 
 class BitrixAPI:
@@ -110,11 +147,45 @@ class BitrixAPI:
         self.session.headers.update({
             'Content-Type': 'application/json',
             'Accept': 'application/json',
-            'User-Agent': 'Python-Bitrix-Chat-Client/1.0'
+            'User-Agent': 'Python-Bitrix-Chat-Client/1.0',
+            'Connection': 'keep-alive'
         })
         
-        # Set longer timeout for debugging
-        self.session.timeout = 60
+        # Larger keep-alive pool for concurrent calls. Only connection
+        # failures are retried, since nothing reached the server. Every call
+        # is a POST, and a read timeout or 502/504 on addMessage or
+        # createTokenApi may come after the backend already ran it
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                connect=3,
+                read=0,
+                status=0,
+                backoff_factor=0.3
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # (connect, read) timeout; requests ignores Session.timeout
+        self.timeout = (5, 60)
+        
+        # Endpoints that answered successfully, tried first on later calls
+        self._customers_endpoint: Optional[str] = None
+        self._subscriptions_method: Optional[str] = None
+        # Set once the portal reports batch as missing; later batches go
+        # straight to individual calls
+        self._batch_unsupported = False
+        
+        # Method URLs are fixed for the lifetime of the client
+        self._method_url_prefix = f"{self.base_url}/{self.user_id}/{self.token}"
+        self._url_cache = {}
+        
+        # Response cache for read-only methods: key -> (result, expires_at)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
         
         print(f"Initialized API with user_id: {self.user_id}")
         print(f"API base URL: {self.base_url}/{self.user_id}/{self.token[:20]}...user.current")
@@ -129,7 +200,10 @@ class BitrixAPI:
         Returns:
             Full URL with user_id and token
         """
-        return f"{self.base_url}/{self.user_id}/{self.token}/{method}"
+        url = self._url_cache.get(method)
+        if url is None:
+            url = self._url_cache[method] = f"{self._method_url_prefix}/{method}"
+        return url
     
     def call_method(self, method: str, params: Dict = None) -> Dict:
         """
@@ -145,15 +219,14 @@ class BitrixAPI:
         url = self._get_api_url(method)
         
         try:
-            start_time = datetime.now()
-            response = self.session.post(url, json=params or {}, timeout=60)
-            elapsed = (datetime.now() - start_time).total_seconds()
+            response = self.session.post(url, data=_dumps(params or {}), timeout=self.timeout)
             
             try:
-                result = response.json()
+                result = _loads(response.content)
                 return result
-            except json.JSONDecodeError as e:
-                text = response.text[:1000]
+            except ValueError as e:
+                # Bitrix answers in UTF-8; skip requests' charset detection
+                text = response.content[:1000].decode('utf-8', 'replace')
                 return {"error": f"JSON decode error: {e}", "text": text}
                 
         except requests.Timeout:
@@ -163,24 +236,160 @@ class BitrixAPI:
         except Exception as e:
             return {"error": str(e), "result": None}
     
+    def _cache_key(self, method: str, params: Dict = None) -> Tuple[str, str]:
+        return method, json.dumps(params or {}, sort_keys=True, default=str)
+    
+    def _call_cached(self, method: str, params: Dict = None, ttl: float = 60) -> Dict:
+        """
+        Call a read-only API method through the response cache
+        
+        Args:
+            method: API method name
+            params: Request parameters
+            ttl: Seconds a successful response stays fresh
+            
+        Returns:
+            API response as dictionary; callers get their own copy, so
+            mutating it never changes the cached entry
+        """
+        key = self._cache_key(method, params)
+        
+        with self._cache_lock:
+            entry = self._cache.get(key)
+        
+        if entry:
+            result, expires_at = entry
+            if time.monotonic() < expires_at:
+                return copy.deepcopy(result)
+        
+        result = self.call_method(method, params)
+        self._store_cached(key, result, ttl)
+        return result
+    
+    def _store_cached(self, key: Tuple[str, str], result: Dict, ttl: float):
+        # Errors are never cached so the next call retries
+        if result and not result.get("error"):
+            with self._cache_lock:
+                self._cache[key] = (copy.deepcopy(result), time.monotonic() + ttl)
+    
+    def invalidate_cache(self, prefix: str = ""):
+        """
+        Drop cached responses
+        
+        Args:
+            prefix: Only drop methods starting with this prefix (default: all)
+        """
+        with self._cache_lock:
+            for key in [k for k in self._cache if k[0].startswith(prefix)]:
+                del self._cache[key]
+    
+    def fetch_many(self, calls: List[Union[str, Tuple[str, Dict], Callable[[], Dict]]]) -> List[Dict]:
+        """
+        Run independent API calls concurrently
+        
+        Args:
+            calls: Method names, (method, params) tuples or zero-argument
+                   callables such as bound wrapper methods
+            
+        Returns:
+            Results in the same order as calls
+        """
+        def run(call):
+            if callable(call):
+                return call()
+            if isinstance(call, tuple):
+                return self.call_method(*call)
+            return self.call_method(call)
+        
+        if len(calls) < 2:
+            return [run(call) for call in calls]
+        
+        with ThreadPoolExecutor(max_workers=min(len(calls), 8)) as pool:
+            return list(pool.map(run, calls))
+    
+    def batch(self, calls: Dict[str, Tuple[str, Dict]], halt: bool = False) -> Dict[str, Dict]:
+        """
+        Run several API methods in a single HTTP request via Bitrix batch
+        
+        Args:
+            calls: Mapping of command name to (method, params)
+            halt: Stop at the first failing command
+            
+        Returns:
+            Mapping of command name to a call_method-style response
+            ({"result": ...} or {"error": ...})
+        """
+        if self._batch_unsupported:
+            return self._call_in_order(calls, halt)
+        
+        cmd = {
+            name: f"{method}?{_build_query(params)}" if params else method
+            for name, (method, params) in calls.items()
+        }
+        data = self.call_method("batch", {"halt": int(halt), "cmd": cmd})
+        
+        batch_result = data.get("result") if data and not data.get("error") else None
+        if not isinstance(batch_result, dict):
+            # Remember only that the portal has no batch method; throttling,
+            # expired tokens and transport errors are transient, so batch is
+            # tried again next time
+            if data and data.get("error") in _BATCH_MISSING_ERRORS:
+                self._batch_unsupported = True
+            # Batch unavailable, issue the calls individually
+            return self._call_in_order(calls, halt)
+        
+        # Bitrix returns [] instead of {} for empty sections
+        results = batch_result.get("result") or {}
+        errors = batch_result.get("result_error") or {}
+        
+        responses = {}
+        for name in calls:
+            if name in errors:
+                responses[name] = {"error": errors[name], "result": None}
+            else:
+                responses[name] = {"result": results.get(name)}
+        return responses
+    
+    def _call_in_order(self, calls: Dict[str, Tuple[str, Dict]], halt: bool) -> Dict[str, Dict]:
+        """Run batch commands one by one, in order, as Bitrix batch does"""
+        responses = {}
+        failed = False
+        for name, (method, params) in calls.items():
+            if failed:
+                # Like batch with halt, commands after a failure are skipped
+                responses[name] = {"result": None}
+                continue
+            responses[name] = self.call_method(method, params)
+            failed = halt and bool(responses[name].get("error"))
+        return responses
+    
     # User profile methods
     def get_current_profile(self) -> Dict:
-        return self.call_method("profile")
+        return self._call_cached("profile", ttl=300)
     
     def list_managers(self) -> Dict:
-        return self.call_method("uad.shop.api.profile.listManagers")
+        return self._call_cached("uad.shop.api.profile.listManagers", ttl=300)
     
     # Chat methods
     def get_groups(self) -> Dict:
-        return self.call_method("uad.shop.api.chat.getGroups")
+        return self._call_cached("uad.shop.api.chat.getGroups", ttl=30)
     
     def get_messages(self, group_id: int) -> Dict:
         return self.call_method("uad.shop.api.chat.getMessages", {"group": group_id})
     
+    def read_messages(self, group_id: int) -> Dict:
+        """Clear a group's notifications and fetch its messages in one request"""
+        self.invalidate_cache("uad.shop.api.chat.")
+        return self.batch({
+            "clear": ("uad.shop.api.chat.clearNotifications", {"group": group_id}),
+            "messages": ("uad.shop.api.chat.getMessages", {"group": group_id})
+        })["messages"]
+    
     def get_user_news_content(self) -> Dict:
         return self.call_method("uad.shop.api.chat.getUserNewsContent")
     
     def clear_notifications(self, group_id: int) -> Dict:
+        self.invalidate_cache("uad.shop.api.chat.")
         return self.call_method("uad.shop.api.chat.clearNotifications", {"group": group_id})
     
     def get_notifications(self) -> Dict:
@@ -196,25 +405,15 @@ class BitrixAPI:
         
         if document_id:
             params["documentId"] = document_id
-            
+        
+        self.invalidate_cache("uad.shop.api.chat.")
         return self.call_method("uad.shop.api.chat.createGroup", params)
     
     def add_message(self, group, message: str) -> Dict:
-        group_data = {
-            "id": group.id,
-            "title": group.title or "",
-            "participants": group.participants,
-            "participant_names": group.participant_names,
-            "unread_count": group.unread_count,
-            "type": group.type,
-            "site": group.site,
-            "author": group.author or 0,
-            "date": group.date or "",
-            "pinned": group.pinned
-        }
-        
-        group_json = json.dumps(group_data, ensure_ascii=False)
+        # The endpoint expects the group as a JSON string inside the payload
+        group_json = _dumps(group.to_api_dict()).decode('utf-8')
         
+        self.invalidate_cache("uad.shop.api.chat.")
         return self.call_method("uad.shop.api.chat.addMessage", {
             "group": group_json,
             "message": message
@@ -227,12 +426,14 @@ class BitrixAPI:
         })
     
     def add_group_participants(self, chat_id: int, user_ids: List[int]) -> Dict:
+        self.invalidate_cache("uad.shop.api.chat.")
         return self.call_method("uad.shop.api.chat.addGroupParticipants", {
             "chatId": chat_id,
             "userIds": user_ids
         })
     
     def remove_group_participants(self, chat_id: int, user_ids: List[int]) -> Dict:
+        self.invalidate_cache("uad.shop.api.chat.")
         return self.call_method("uad.shop.api.chat.removeGroupParticipants", {
             "chatId": chat_id,
             "userIds": user_ids
@@ -241,17 +442,20 @@ class BitrixAPI:
     def activate_subscriptions(self) -> Dict:
         """Activate WebSocket subscriptions"""
         try:
-            # First try the chat-specific method
-            result = self.call_method("uad.shop.api.chat.activateSubscriptions")
+            if self._subscriptions_method:
+                result = self.call_method(self._subscriptions_method)
+                if result and not result.get("error"):
+                    return result
             
-            if result and not result.get("error"):
-                return result
-            
-            # Fallback to generic pull method
-            result = self.call_method("pull.config.get")
+            # Query the chat-specific and generic pull methods together,
+            # preferring the chat-specific result
+            methods = ["uad.shop.api.chat.activateSubscriptions", "pull.config.get"]
+            results = self.fetch_many(methods)
             
-            if result and not result.get("error"):
-                return result
+            for method, result in zip(methods, results):
+                if result and not result.get("error"):
+                    self._subscriptions_method = method
+                    return result
             
             # If both fail, return empty result
             return {"result": {}}
@@ -267,10 +471,19 @@ class BitrixAPI:
             "uad.shop.api.customer.getAll"
         ]
         
+        if self._customers_endpoint:
+            data = self._call_cached(self._customers_endpoint, ttl=300)
+            if data and not data.get("error"):
+                return data
+        
         for endpoint in endpoints:
-            data = self.call_method(endpoint)
+            if endpoint == self._customers_endpoint:
+                continue
+            
+            data = self._call_cached(endpoint, ttl=300)
             
             if data and not data.get("error"):
+                self._customers_endpoint = endpoint
                 return data
         
         # If all fail, return empty result
@@ -288,10 +501,10 @@ class BitrixAPI:
     # Document methods
     def get_documents(self, doc_type: str, contractor_id: str = "", document_id: str = "") -> Dict:
         """Get documents - simplified version"""
-        return self.call_method("uad.shop.api.docview.getDocuments", {
+        return self._call_cached("uad.shop.api.docview.getDocuments", {
             "page": 0,
             "filter": {"type": doc_type}
-        })
+        }, ttl=60)
     
     # API Token Management Methods
     def get_token_api(self) -> Dict:
@@ -311,16 +524,18 @@ class BitrixAPI:
             "name": name,
             "expires_in_days": expires_in_days
         }
+        self.invalidate_cache("base.api.user.")
         return self.call_method("base.api.user.createTokenApi", params)
     
     def revoke_token_api(self, token_id: str) -> Dict:
         """Revoke/delete API token"""
+        self.invalidate_cache("base.api.user.")
         return self.call_method("base.api.user.revokeTokenApi", {"token_id": token_id})
     
     def list_tokens_api(self) -> Dict:
         """List all API tokens"""
-        return self.call_method("base.api.user.listTokensApi")
+        return self._call_cached("base.api.user.listTokensApi", ttl=60)
     
     def get_current_token_info(self) -> Dict:
         """Get information about current API token"""
-        return self.call_method("base.api.user.getCurrentTokenInfo")
\ No newline at end of file
+        return self._call_cached("base.api.user.getCurrentTokenInfo", ttl=60)
\ No newline at end of file
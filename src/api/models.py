@@ -2,11 +2,25 @@
 Data models for Bitrix24 Chat
 """
 
+import sys
+from functools import lru_cache
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional
 from datetime import datetime
 
-@dataclass
+# Slotted dataclasses (no per-instance __dict__) where supported
+_model = dataclass(slots=True) if sys.version_info >= (3, 10) else dataclass
+
+@lru_cache(maxsize=1024)
+def _format_time(timestamp: str) -> str:
+    try:
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        return datetime.fromisoformat(timestamp).strftime("%H:%M")
+    except (ValueError, TypeError, AttributeError):
+        return timestamp
+
+@_model
 class User:
     id: int
     name: str = ""
@@ -25,7 +39,7 @@ class User:
             return self.full_name
         return self.email or f"User {self.id}"
 
-@dataclass
+@_model
 class Customer:
     id: int
     xml_id: str
@@ -36,7 +50,7 @@ class Customer:
     def full_name(self) -> str:
         return f"{self.name} {self.last_name}".strip()
 
-@dataclass
+@_model
 class Group:
     id: int
     title: str
@@ -51,18 +65,15 @@ class Group:
     type: str = "messageGroup"
     site: str = ""
     
-    def display_title(self, current_user, customers) -> str:
+    def display_title(self, current_user, customers_by_id: Dict[int, "Customer"]) -> str:
         if self.title and self.title.strip():
             return self.title
         
-        other_participants = []
-        other_participant_names = []
-        
-        for i, participant_id in enumerate(self.participants):
-            if participant_id != current_user.id:
-                other_participants.append(participant_id)
-                if i < len(self.participant_names):
-                    other_participant_names.append(self.participant_names[i])
+        other_participants = [pid for pid in self.participants if pid != current_user.id]
+        other_participant_names = [
+            name for pid, name in zip(self.participants, self.participant_names)
+            if pid != current_user.id
+        ]
         
         if not other_participants:
             return "Saved Messages"
@@ -70,17 +81,30 @@ class Group:
         if other_participant_names:
             return ", ".join(other_participant_names[:3]) + ("" if len(other_participant_names) <= 3 else "...")
         
-        participant_names = []
-        for customer in customers:
-            if customer.id in other_participants:
-                participant_names.append(customer.full_name)
+        participant_names = [
+            customers_by_id[pid].full_name for pid in other_participants if pid in customers_by_id
+        ]
         
         if participant_names:
             return ", ".join(participant_names[:3]) + ("" if len(participant_names) <= 3 else "...")
         
         return f"Chat with {len(other_participants)} participants"
+    
+    def to_api_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "title": self.title or "",
+            "participants": self.participants,
+            "participant_names": self.participant_names,
+            "unread_count": self.unread_count,
+            "type": self.type,
+            "site": self.site,
+            "author": self.author or 0,
+            "date": self.date or "",
+            "pinned": self.pinned
+        }
 
-@dataclass
+@_model
 class Message:
     id: int
     text: str
@@ -93,8 +117,5 @@ class Message:
     
     @property
     def time_display(self) -> str:
-        try:
-            dt = datetime.fromisoformat(self.timestamp.replace('Z', '+00:00'))
-            return dt.strftime("%H:%M")
-        except:
-            return self.timestamp
\ No newline at end of file
+        # Formatted on access so it follows timestamp; _format_time is cached
+        return _format_time(self.timestamp)
\ No newline at end of file
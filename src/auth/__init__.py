@@ -2,26 +2,37 @@
 Authentication module for Bitrix24
 """
 
-from .chrome_auth import ChromeAuthApp
 from .auth_manager import (
     authenticate_and_get_env,
     authenticate_from_captured_data
 )
 from .env_handler import (
+    iter_env_file,
     load_env_file, 
     save_env_file, 
     get_env_var, 
     set_env_var,
-    create_env_file_from_auth
+    create_env_file_from_auth,
+    write_file_atomic
 )
 
 __all__ = [
     'ChromeAuthApp',
     'authenticate_and_get_env',
     'authenticate_from_captured_data',
+    'iter_env_file',
     'load_env_file',
     'save_env_file',
     'get_env_var',
     'set_env_var',
-    'create_env_file_from_auth'
-]
\ No newline at end of file
+    'create_env_file_from_auth',
+    'write_file_atomic'
+]
+
+
+def __getattr__(name):
+    # ChromeAuthApp pulls in selenium; only import it when first requested
+    if name == 'ChromeAuthApp':
+        from .chrome_auth import ChromeAuthApp
+        return ChromeAuthApp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
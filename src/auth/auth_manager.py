@@ -7,6 +7,24 @@ import json
 import re
 from typing import Dict, Optional
 
+from .env_handler import write_file_atomic
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps_pretty = lambda obj: orjson.dumps(
+        obj,
+        default=str,
+        option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    )
+except ImportError:
+    _loads = json.loads
+    _dumps_pretty = lambda obj: (json.dumps(obj, indent=2, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+_DIGITS_RE = re.compile(r'\d+')
+_USER_KEY_RE = re.compile(r'user|uid', re.I)
+_PULL_CFG_RE = re.compile(r'pull.*config|config.*pull', re.I)
+
 def authenticate_and_get_env():
     """Enhanced authentication function with better error handling"""
     print("\n" + "="*60)
@@ -36,7 +54,7 @@ def authenticate_and_get_env():
             input("\nPress Enter after logging in...")
             
             # Save cookies for future use
-            app.save_cookies_pickle()
+            app.save_cookies_json()
             print("✓ Cookies saved for future use")
         else:
             print("✓ Auto-login successful")
@@ -61,27 +79,28 @@ def authenticate_and_get_env():
         print("\nSaving authentication data...")
         from .env_handler import create_env_file_from_auth
         
-        # Get auth data from browser
+        # Get auth data from browser (storage, URL and title in one round-trip;
+        # cookies separately since document.cookie hides HttpOnly ones)
+        page_state = app.get_page_state()
         auth_data = {
             'user_id': user_id,
-            'cookies': app.get_cookies() if hasattr(app, 'get_cookies') else {},
-            'local_storage': app.get_local_storage() if hasattr(app, 'get_local_storage') else {},
-            'session_storage': app.get_session_storage() if hasattr(app, 'get_session_storage') else {},
-            'current_url': app.driver.current_url,
-            'page_title': app.driver.title,
+            'cookies': app.get_cookies(),
+            'local_storage': page_state.get('local_storage', {}),
+            'session_storage': page_state.get('session_storage', {}),
+            'current_url': page_state.get('url', ''),
+            'page_title': page_state.get('title', ''),
             'tokens': {'api_token': api_token} if api_token else {},
             'csrf_tokens': app.csrf_tokens if hasattr(app, 'csrf_tokens') else {}
         }
         
         # Save to file
-        with open('auth_data_full.json', 'w', encoding='utf-8') as f:
-            json.dump(auth_data, f, indent=2, default=str)
+        write_file_atomic('auth_data_full.json', _dumps_pretty(auth_data))
         
         env_content = create_env_file_from_auth(auth_data)
         
         print(f"\n✓ Auth data saved to .env file ({len(env_content)} entries)")
         print(f"✓ Full auth data saved to auth_data_full.json")
-        print(f"✓ Current URL: {app.driver.current_url[:80]}...")
+        print(f"✓ Current URL: {auth_data['current_url'][:80]}...")
         
         print("\n" + "="*60)
         print("AUTHENTICATION COMPLETE")
@@ -110,8 +129,8 @@ def authenticate_from_captured_data():
     try:
         # Load auth data from JSON
         if os.path.exists('auth_data_full.json'):
-            with open('auth_data_full.json', 'r', encoding='utf-8') as f:
-                auth_data = json.load(f)
+            with open('auth_data_full.json', 'rb') as f:
+                auth_data = _loads(f.read())
             
             print("✓ Loaded authentication data from auth_data_full.json")
             
@@ -130,10 +149,10 @@ def authenticate_from_captured_data():
             # Try to get user ID from BITRIX_SM_UIDH or other cookies
             if not user_id:
                 for cookie_name, cookie_value in cookies.items():
-                    if 'user' in cookie_name.lower() or 'uid' in cookie_name.lower():
+                    if _USER_KEY_RE.search(cookie_name):
                         try:
                             # Try to extract numeric ID
-                            match = re.search(r'\d+', cookie_value)
+                            match = _DIGITS_RE.search(cookie_value)
                             if match:
                                 user_id = int(match.group())
                                 print(f"✓ User ID from {cookie_name}: {user_id}")
@@ -161,11 +180,14 @@ def authenticate_from_captured_data():
                 "pull-config",
             ]
             
+            # Local storage first, session storage if it is missing or corrupt
+            storages = (local_storage, session_storage)
+            
             for pattern in key_patterns:
-                for storage in [local_storage, session_storage]:
+                for storage in storages:
                     if pattern in storage:
                         try:
-                            pull_config = json.loads(storage[pattern])
+                            pull_config = _loads(storage[pattern])
                             print(f"✓ Found Pull config with key: {pattern}")
                             break
                         except json.JSONDecodeError:
@@ -175,11 +197,11 @@ def authenticate_from_captured_data():
             
             # If still no config found, search for any key containing 'pull' and 'config'
             if not pull_config:
-                for storage in [local_storage, session_storage]:
-                    for key in storage.keys():
-                        if 'pull' in key.lower() and 'config' in key.lower():
+                for storage in storages:
+                    for key, value in storage.items():
+                        if _PULL_CFG_RE.search(key):
                             try:
-                                pull_config = json.loads(storage[key])
+                                pull_config = _loads(value)
                                 print(f"✓ Found Pull config with alternative key: {key}")
                                 break
                             except json.JSONDecodeError:
@@ -199,8 +221,7 @@ def authenticate_from_captured_data():
                 result['pull_config'] = pull_config
                 
                 # Save Pull config to separate file
-                with open('pull_config.json', 'w', encoding='utf-8') as f:
-                    json.dump(pull_config, f, indent=2, ensure_ascii=False)
+                write_file_atomic('pull_config.json', _dumps_pretty(pull_config))
                 
                 print(f"✓ Pull configuration saved to pull_config.json")
                 
@@ -6,48 +6,432 @@ Uses Selenium for browser automation to capture authentication data
 import os
 import time
 import json
-import pickle
+import threading
+from pathlib import Path
 from typing import Optional
 from urllib.parse import urlparse, parse_qs
 
 # Selenium imports for browser automation
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+    _dumps = lambda obj: json.dumps(obj).encode('utf-8')
+
+try:
+    from .env_handler import write_file_atomic
+except ImportError:
+    # Run directly as a script, without the package context
+    from env_handler import write_file_atomic
+
+# CSRF token and site ID lookup: meta tag, BX.bitrix_sessid(), BX.message,
+# window, form inputs, URL and only then a scan of inline scripts, all in one
+# round-trip; each branch returns early so the script scan is rarely reached
+_CSRF_JS = r"""
+// Compiled once per page and reused by later calls
+var PATTERNS = window.__csrfPatterns || (window.__csrfPatterns = [
+    /bitrix_sessid['"]?\s*[:=]\s*['"]([^'"]+)['"]/i,
+    /sessid['"]?\s*[:=]\s*['"]([a-f0-9]+)['"]/i,
+    /csrf['"]?\s*[:=]\s*['"]([a-f0-9]+)['"]/i
+]);
+var hasBXMessage = typeof BX !== 'undefined' && typeof BX.message === 'function';
+
+function findCsrf() {
+    var csrf = document.querySelector('meta[name="x-bitrix-csrf-token"]');
+    if (csrf && csrf.getAttribute('content')) {
+        return csrf.getAttribute('content');
+    }
+    
+    try {
+        if (typeof BX !== 'undefined' && typeof BX.bitrix_sessid === 'function' && BX.bitrix_sessid()) {
+            return BX.bitrix_sessid();
+        }
+        if (hasBXMessage && BX.message('bitrix_sessid')) {
+            return BX.message('bitrix_sessid');
+        }
+    } catch (e) {}
+    
+    if (typeof window.bitrix_sessid !== 'undefined' && window.bitrix_sessid) {
+        return window.bitrix_sessid;
+    }
+    
+    var form_csrf = document.querySelector('input[name="sessid"], input[name="csrf"], input[name="bitrix_sessid"]');
+    if (form_csrf && form_csrf.value) {
+        return form_csrf.value;
+    }
+    
+    try {
+        var urlParams = new URLSearchParams(window.location.search);
+        var from_url = urlParams.get('sessid') || urlParams.get('csrf') || urlParams.get('bitrix_sessid');
+        if (from_url) {
+            return from_url;
+        }
+    } catch (e) {}
+    
+    // Read every inline script once, then try patterns in priority order
+    var scripts = document.getElementsByTagName('script');
+    var texts = [];
+    for (var i = 0; i < scripts.length; i++) {
+        var text = scripts[i].textContent;
+        if (text && (text.indexOf('sessid') !== -1 || text.indexOf('csrf') !== -1)) {
+            texts.push(text);
+        }
+    }
+    for (var p = 0; p < PATTERNS.length; p++) {
+        for (var t = 0; t < texts.length; t++) {
+            var match = PATTERNS[p].exec(texts[t]);
+            if (match && match[1]) {
+                return match[1];
+            }
+        }
+    }
+    return null;
+}
+
+var site_id = 'ap';
+var site_meta = document.querySelector('meta[name="x-bitrix-site-id"]');
+if (site_meta) {
+    site_id = site_meta.getAttribute('content');
+} else if (hasBXMessage) {
+    var bx_site_id = BX.message('site_id') || BX.message('SITE_ID');
+    if (bx_site_id) {
+        site_id = bx_site_id;
+    }
+}
+
+return {csrf: findCsrf(), site_id: site_id};
+"""
+
+# True once the page exposes a CSRF token through the meta tag or BX
+_CSRF_READY_JS = r"""
+return !!document.querySelector('meta[name="x-bitrix-csrf-token"]') ||
+    (typeof BX !== 'undefined' && typeof BX.message === 'function' && !!BX.message('bitrix_sessid'));
+"""
+
+# User ID lookup: BX.User, global BX, auth cookies, then page elements
+_USER_ID_JS = """
+var user_id = null;
+
+// Method 1: BX API (most reliable)
+if (typeof BX !== 'undefined' && typeof BX.User !== 'undefined') {
+    if (typeof BX.User.getId === 'function') {
+        user_id = BX.User.getId();
+        console.log('User ID from BX.User.getId:', user_id);
+    }
+}
+
+// Method 2: Global BX object
+if (!user_id && typeof BX !== 'undefined') {
+    if (BX.user_id) {
+        user_id = BX.user_id;
+        console.log('User ID from BX.user_id:', user_id);
+    } else if (BX.userId) {
+        user_id = BX.userId;
+        console.log('User ID from BX.userId:', user_id);
+    }
+}
+
+// Method 3: Cookies
+if (!user_id) {
+    var cookies = document.cookie.split(';');
+    for (var i = 0; i < cookies.length; i++) {
+        var cookie = cookies[i].trim();
+        if (cookie.indexOf('UID=') === 0) {
+            var uid = cookie.substring('UID='.length);
+            if (uid && !isNaN(parseInt(uid))) {
+                user_id = parseInt(uid);
+                console.log('User ID from UID cookie:', user_id);
+                break;
+            }
+        }
+        if (cookie.indexOf('USER_ID=') === 0) {
+            var uid = cookie.substring('USER_ID='.length);
+            if (uid && !isNaN(parseInt(uid))) {
+                user_id = parseInt(uid);
+                console.log('User ID from USER_ID cookie:', user_id);
+                break;
+            }
+        }
+        if (cookie.indexOf('BITRIX_SM_UID=') === 0) {
+            var uid = cookie.substring('BITRIX_SM_UID='.length);
+            if (uid && !isNaN(parseInt(uid))) {
+                user_id = parseInt(uid);
+                console.log('User ID from BITRIX_SM_UID cookie:', user_id);
+                break;
+            }
+        }
+    }
+}
+
+// Method 4: Page elements
+if (!user_id) {
+    var selectors = [
+        '[data-user-id]',
+        '[data-uid]',
+        '[data-id]',
+        '.user-id',
+        '.user_id',
+        '#user_id',
+        '#userId'
+    ];
+
+    for (var j = 0; j < selectors.length; j++) {
+        var elem = document.querySelector(selectors[j]);
+        if (elem) {
+            var uid = elem.getAttribute('data-user-id') || 
+                      elem.getAttribute('data-uid') || 
+                      elem.getAttribute('data-id') ||
+                      elem.getAttribute('value') ||
+                      elem.textContent;
+
+            if (uid) {
+                var match = uid.toString().match(/(\\d+)/);
+                if (match) {
+                    user_id = parseInt(match[1]);
+                    console.log('User ID from element (' + selectors[j] + '):', user_id);
+                    break;
+                }
+            }
+        }
+    }
+}
+
+// Method 5: Default to 1
+if (!user_id) {
+    user_id = 1;
+    console.log('User ID defaulting to:', user_id);
+}
+
+return user_id;
+"""
+
+# CSRF token, site ID and user ID in a single round-trip:
+# {csrf, site_id, user_id}
+_PAGE_AUTH_JS = (
+    "var page = (function() {" + _CSRF_JS + "})();\n"
+    "page.user_id = (function() {" + _USER_ID_JS + "})();\n"
+    "return page;"
+)
+
+# getTokenApi and, only when it returns no token, createTokenApi, chained in
+# one execute_async_script call; resolves with {existing, created}
+_GET_OR_CREATE_TOKEN_JS = r"""
+var csrf = arguments[0], site_id = arguments[1], create_body = arguments[2];
+var done = arguments[arguments.length - 1];
+
+function post(action, body) {
+    return fetch('/bitrix/services/main/ajax.php?action=' + encodeURIComponent(action), {
+        method: 'POST',
+        credentials: 'include',
+        keepalive: true,
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'x-bitrix-csrf-token': csrf,
+            'x-bitrix-site-id': site_id,
+            'bx-ajax': 'true'
+        },
+        body: body
+    }).then(function(r) { return r.text(); }).then(function(text) {
+        try { return JSON.parse(text); } catch (e) { return {error: 'Parse error', raw: text}; }
+    }, function(e) {
+        return {error: String(e)};
+    });
+}
+
+function hasToken(result) {
+    var data = result && result.status === 'success' && result.data;
+    return !!data && (typeof data === 'string' || !!data.PASSWORD);
+}
+
+post('me:base.api.user.getTokenApi', '').then(function(existing) {
+    if (hasToken(existing)) {
+        done({existing: existing});
+        return;
+    }
+    return post('me:base.api.user.createTokenApi', create_body).then(function(created) {
+        done({existing: existing, created: created});
+    });
+}).catch(function(e) { done({existing: {error: String(e)}}); });
+"""
+
+_LOCAL_STORAGE_JS = """
+var items = {};
+for (var i = 0; i < localStorage.length; i++) {
+    var key = localStorage.key(i);
+    items[key] = localStorage.getItem(key);
+}
+return items;
+"""
+
+_SESSION_STORAGE_JS = """
+var items = {};
+for (var i = 0; i < sessionStorage.length; i++) {
+    var key = sessionStorage.key(i);
+    items[key] = sessionStorage.getItem(key);
+}
+return items;
+"""
+
+# Both storages, URL and title in a single round-trip:
+# {local_storage, session_storage, url, title}
+_PAGE_STATE_JS = (
+    "return {\n"
+    "    local_storage: (function() {" + _LOCAL_STORAGE_JS + "})(),\n"
+    "    session_storage: (function() {" + _SESSION_STORAGE_JS + "})(),\n"
+    "    url: location.href,\n"
+    "    title: document.title\n"
+    "};"
+)
+
+# Skip first-run UI, sync, component updates and other background work
+# that a one-shot auth browser never needs
+_CHROME_STARTUP_ARGS = (
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-default-apps",
+    "--disable-component-update",
+    "--disable-breakpad",
+    "--disable-ipc-flooding-protection",
+    "--disable-renderer-backgrounding",
+    "--disable-backgrounding-occluded-windows",
+    "--metrics-recording-only",
+    "--mute-audio",
+    "--disable-features=Translate,MediaRouter",
+)
+
+# Cookie name prefixes reported as Bitrix cookies by check_bitrix_cookies
+_BITRIX_COOKIE_PREFIXES = ('BITRIX_', 'UID', 'USER_ID')
+
+# WebDriver cookie fields that CDP Network.setCookies accepts under the same name
+_CDP_COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite')
+
+# Cookies that indicate an authenticated Bitrix24 session
+_IMPORTANT_COOKIES = {
+    'BITRIX_SM_UIDL': 'Primary user authentication cookie',
+    'BITRIX_SM_GUEST_ID': 'Guest session identifier',
+    'BITRIX_SM_LAST_VISIT': 'Last visit timestamp',
+    'BITRIX_SM_LAST_ADV': 'Last advertisement click',
+    'PHPSESSID': 'PHP session ID',
+    'UID': 'User ID cookie'
+}
 
 class ChromeAuthApp:
-    def __init__(self, headless=False):
+    def __init__(self, headless=False, profile_dir=None):
+        """
+        Args:
+            headless: Run Chrome without a window
+            profile_dir: Chrome user-data-dir kept between runs so cookies and
+                storage survive restarts; defaults to ~/.chatbitrix_chrome_profile
+        """
         self.chrome_options = Options()
         
+        self.profile_dir = Path(profile_dir) if profile_dir else Path.home() / '.chatbitrix_chrome_profile'
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.chrome_options.add_argument(f"--user-data-dir={self.profile_dir}")
+        self.chrome_options.add_argument("--profile-directory=Default")
+        
         if not headless:
             self.chrome_options.add_argument("--start-maximized")
         else:
             self.chrome_options.add_argument("--headless")
+            # Nobody looks at the page in headless mode
+            self.chrome_options.add_argument("--blink-settings=imagesEnabled=false")
         
+        # driver.get() returns at DOMContentLoaded instead of waiting for
+        # every image, tracker and font on the page
+        self.chrome_options.page_load_strategy = 'eager'
         self.chrome_options.add_argument("--disable-notifications")
         self.chrome_options.add_argument("--disable-popup-blocking")
+        for arg in _CHROME_STARTUP_ARGS:
+            self.chrome_options.add_argument(arg)
         self.chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         self.chrome_options.add_experimental_option('useAutomationExtension', False)
         
         self.driver = webdriver.Chrome(options=self.chrome_options)
+        # Explicit WebDriverWait is the only element timeout; an implicit wait
+        # would be added to every element lookup those waits make
+        self.driver.implicitly_wait(0)
         self.wait = WebDriverWait(self.driver, 10)
+        # Upper bound for execute_async_script calls such as _get_or_create_token
+        self.driver.set_script_timeout(30)
         
         self.tokens = {}
         self.csrf_tokens = {}
         self.target_url = "https://ugautodetal.ru/?login=yes"
         self.url_watch_active = False
     
+    def wait_for_page_ready(self):
+        """Wait until the current document has a body and its DOM is parsed"""
+        try:
+            self.wait.until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+            self.wait.until(lambda driver: driver.execute_script("return document.readyState") != "loading")
+        except TimeoutException:
+            print("   ⚠️  Page did not finish loading in time, continuing...")
+    
     def navigate_to_login(self, url):
         """Navigate to login page"""
         self.driver.get(url)
-        time.sleep(2)
+        self.wait_for_page_ready()
         return self.driver.current_url
     
-    def watch_for_target_url(self, timeout=300, check_interval=2):
+    def _wait_for_url(self, predicate, timeout, interval=0.1, max_interval=2.0, backoff=1.5):
+        """
+        Poll driver.current_url until predicate(url) is true and return that URL
+        
+        The delay between polls starts at `interval` and grows by `backoff` up
+        to `max_interval`; it drops back to `interval` whenever the URL changes,
+        since a navigation usually means the wait is about to end.
+        Raises TimeoutException when `timeout` seconds pass without a match.
+        """
+        deadline = time.monotonic() + timeout
+        sleep_for = interval
+        last_url = None
+        while True:
+            current_url = self.driver.current_url
+            if predicate(current_url):
+                return current_url
+            if current_url != last_url:
+                sleep_for = interval
+                last_url = current_url
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutException(f"URL condition not met within {timeout} seconds")
+            time.sleep(min(sleep_for, remaining))
+            sleep_for = min(sleep_for * backoff, max_interval)
+    
+    def _start_progress_thread(self, interval, report):
+        """
+        Call report(elapsed_seconds) every `interval` seconds on a daemon thread
+        
+        Keeps progress output out of the polling loop. Returns (stop_event,
+        thread); set the event and join the thread once waiting is over.
+        """
+        stop_event = threading.Event()
+        start_time = time.monotonic()
+        
+        def run():
+            while not stop_event.wait(interval):
+                report(int(time.monotonic() - start_time))
+        
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return stop_event, thread
+    
+    def watch_for_target_url(self, timeout=300, check_interval=2.0):
         """
         Watch for the target URL to appear
+        Polling starts at 100ms and backs off to at most check_interval seconds
         Returns True when target URL is detected
         """
         print(f"\n" + "="*60)
@@ -56,44 +440,42 @@ class ChromeAuthApp:
         print(f"Timeout: {timeout} seconds")
         print(f"="*60)
         
-        start_time = time.time()
+        # Normalize URLs for comparison (remove trailing slashes, etc.)
+        target_normalized = self.target_url.rstrip('/')
         self.url_watch_active = True
+        last_seen_url = None
         
-        while time.time() - start_time < timeout:
-            current_url = self.driver.current_url
-            
-            # Normalize URLs for comparison (remove trailing slashes, etc.)
-            target_normalized = self.target_url.rstrip('/')
-            current_normalized = current_url.rstrip('/')
-            
-            # Check if current URL matches target
-            if target_normalized == current_normalized:
-                print(f"\n✅ TARGET URL DETECTED!")
-                print(f"   Current URL: {current_url}")
-                print(f"   Target URL: {self.target_url}")
-                self.url_watch_active = False
-                return True
-            
-            # Also check if we're on a login-related page
-            if "login" in current_url.lower() or "auth" in current_url.lower():
-                print(f"   🔍 On login page: {current_url}")
-            
-            # Print progress every 10 seconds
-            elapsed = int(time.time() - start_time)
-            if elapsed % 10 == 0:
-                print(f"   ⏱️  Watching... {elapsed}s elapsed (timeout: {timeout}s)")
-                print(f"   Current URL: {current_url}")
-            
-            time.sleep(check_interval)
+        def on_target(current_url):
+            nonlocal last_seen_url
+            last_seen_url = current_url
+            return current_url.rstrip('/') == target_normalized
         
-        print(f"\n❌ TIMEOUT - Target URL not detected within {timeout} seconds")
-        print(f"   Last URL: {self.driver.current_url}")
-        self.url_watch_active = False
-        return False
+        # Print progress every 10 seconds
+        def report(elapsed):
+            print(f"   ⏱️  Watching... {elapsed}s elapsed (timeout: {timeout}s)")
+            print(f"   Current URL: {last_seen_url}")
+        
+        stop_event, progress_thread = self._start_progress_thread(10, report)
+        try:
+            current_url = self._wait_for_url(on_target, timeout, max_interval=check_interval)
+        except TimeoutException:
+            print(f"\n❌ TIMEOUT - Target URL not detected within {timeout} seconds")
+            print(f"   Last URL: {last_seen_url}")
+            return False
+        finally:
+            stop_event.set()
+            progress_thread.join()
+            self.url_watch_active = False
+        
+        print(f"\n✅ TARGET URL DETECTED!")
+        print(f"   Current URL: {current_url}")
+        print(f"   Target URL: {self.target_url}")
+        return True
     
-    def wait_for_login_completion(self, timeout=120, check_interval=2):
+    def wait_for_login_completion(self, timeout=120, check_interval=2.0):
         """
         Wait for login to complete by watching for URL changes
+        Polling starts at 100ms and backs off to at most check_interval seconds
         Returns True when login appears complete
         """
         print(f"\n" + "="*60)
@@ -101,177 +483,134 @@ class ChromeAuthApp:
         print(f"Starting URL: {self.driver.current_url}")
         print(f"="*60)
         
-        start_time = time.time()
-        last_url = self.driver.current_url
+        def left_login_page(current_url):
+            return "login=yes" not in current_url and "auth" not in current_url.lower()
         
-        # Wait for URL to change from login page
-        while time.time() - start_time < timeout:
-            current_url = self.driver.current_url
-            
-            # Check if we've left the login page
-            if "login=yes" not in current_url and "auth" not in current_url.lower():
-                print(f"\n✅ LEFT LOGIN PAGE")
-                print(f"   New URL: {current_url}")
-                
-                # Wait a bit more to ensure page is fully loaded
-                print(f"   Waiting 5 seconds for page to stabilize...")
-                time.sleep(5)
-                return True
-            
-            # Check if URL changed
-            if current_url != last_url:
-                print(f"   🔄 URL changed: {current_url}")
-                last_url = current_url
-            
-            # Print progress every 5 seconds
-            elapsed = int(time.time() - start_time)
-            if elapsed % 5 == 0:
-                print(f"   ⏱️  Still on login page... {elapsed}s")
-            
-            time.sleep(check_interval)
-        
-        print(f"\n❌ TIMEOUT - Still on login page after {timeout} seconds")
-        return False
-    
-    def check_bitrix_cookies(self):
-        """Check for Bitrix authentication cookies"""
-        print("\n" + "="*60)
-        print("CHECKING BITRIX AUTHENTICATION COOKIES")
-        print("="*60)
-        
-        # Check via JavaScript
-        check_cookie_js = """
-        var cookies = document.cookie.split(';');
-        var bitrix_cookies = {};
-        
-        for (var i = 0; i < cookies.length; i++) {
-            var cookie = cookies[i].trim();
-            if (cookie.indexOf('BITRIX_') === 0 || cookie.indexOf('UID') === 0 || cookie.indexOf('USER_ID') === 0) {
-                var parts = cookie.split('=');
-                var name = parts[0];
-                var value = parts[1] || '';
-                bitrix_cookies[name] = value;
-            }
-        }
+        # Print progress every 5 seconds
+        def report(elapsed):
+            print(f"   ⏱️  Still on login page... {elapsed}s")
         
-        console.log('Found Bitrix cookies:', Object.keys(bitrix_cookies));
-        
-        // Also check for any session-related cookies
-        var session_cookies = {};
-        for (var i = 0; i < cookies.length; i++) {
-            var cookie = cookies[i].trim();
-            if (cookie.indexOf('SESSID') !== -1 || cookie.indexOf('sessid') !== -1 || 
-                cookie.indexOf('SESSION') !== -1 || cookie.indexOf('session') !== -1) {
-                var parts = cookie.split('=');
-                var name = parts[0];
-                var value = parts[1] || '';
-                session_cookies[name] = value;
-            }
-        }
+        # Wait for URL to change from login page
+        stop_event, progress_thread = self._start_progress_thread(5, report)
+        try:
+            current_url = self._wait_for_url(left_login_page, timeout, max_interval=check_interval)
+        except TimeoutException:
+            print(f"\n❌ TIMEOUT - Still on login page after {timeout} seconds")
+            return False
+        finally:
+            stop_event.set()
+            progress_thread.join()
         
-        console.log('Found session cookies:', Object.keys(session_cookies));
+        print(f"\n✅ LEFT LOGIN PAGE")
+        print(f"   New URL: {current_url}")
         
-        return {
-            'bitrix_cookies': bitrix_cookies,
-            'session_cookies': session_cookies,
-            'all_cookies': document.cookie
-        };
+        # Wait for the new page to finish loading
+        self.wait_for_page_ready()
+        return True
+    
+    def check_bitrix_cookies(self, verbose=True):
         """
+        Check for Bitrix authentication cookies
         
-        cookies_data = self.driver.execute_script(check_cookie_js)
-        bitrix_cookies = cookies_data.get('bitrix_cookies', {})
-        session_cookies = cookies_data.get('session_cookies', {})
-        
-        # Check via Selenium get_cookies()
-        selenium_cookies = self.driver.get_cookies()
-        
-        print("\n1. JavaScript Cookie Check:")
+        The report is collected into one string and printed with a single
+        write; verbose=False skips it and only returns the status.
+        """
+        report = [
+            "\n" + "="*60,
+            "CHECKING BITRIX AUTHENTICATION COOKIES",
+            "="*60,
+        ]
+        
+        # One cookie-jar round-trip; unlike document.cookie it also sees
+        # HttpOnly cookies such as PHPSESSID and BITRIX_SM_UIDL
+        selenium_cookies = self._page_cookies()
+        all_cookies_dict = {}
+        bitrix_cookies = {}
+        session_cookies = {}
+        bitrix_selenium = []
+        
+        # Classify every cookie in a single pass
+        for cookie in selenium_cookies:
+            name = cookie['name']
+            value = cookie['value']
+            all_cookies_dict[name] = value
+            if name.startswith(_BITRIX_COOKIE_PREFIXES):
+                bitrix_cookies[name] = value
+            if 'SESSID' in name or 'sessid' in name or 'SESSION' in name or 'session' in name:
+                session_cookies[name] = value
+            if 'BITRIX' in name.upper():
+                bitrix_selenium.append(cookie)
+        
+        report.append("\n1. Bitrix Cookie Check:")
         if bitrix_cookies:
-            print("   Found Bitrix cookies:")
+            report.append("   Found Bitrix cookies:")
             for name, value in bitrix_cookies.items():
                 display_value = value[:30] + '...' if len(value) > 30 else value
-                print(f"   - {name}: {display_value}")
+                report.append(f"   - {name}: {display_value}")
         else:
-            print("   ❌ No Bitrix cookies found via JavaScript")
+            report.append("   ❌ No Bitrix cookies found")
         
         if session_cookies:
-            print("\n   Found session cookies:")
+            report.append("\n   Found session cookies:")
             for name, value in session_cookies.items():
                 display_value = value[:30] + '...' if len(value) > 30 else value
-                print(f"   - {name}: {display_value}")
+                report.append(f"   - {name}: {display_value}")
         
-        print("\n2. Selenium Cookie Check:")
-        bitrix_selenium = [c for c in selenium_cookies if 'BITRIX' in c['name'].upper()]
+        report.append("\n2. Selenium Cookie Check:")
         if bitrix_selenium:
-            print("   Found Bitrix cookies via Selenium:")
+            report.append("   Found Bitrix cookies via Selenium:")
             for cookie in bitrix_selenium:
                 value = cookie['value']
                 display_value = value[:30] + '...' if len(value) > 30 else value
-                print(f"   - {cookie['name']}: {display_value}")
+                report.append(f"   - {cookie['name']}: {display_value}")
         else:
-            print("   ❌ No Bitrix cookies found via Selenium")
-        
-        # Check for specific important cookies
-        important_cookies = {
-            'BITRIX_SM_UIDL': 'Primary user authentication cookie',
-            'BITRIX_SM_GUEST_ID': 'Guest session identifier',
-            'BITRIX_SM_LAST_VISIT': 'Last visit timestamp',
-            'BITRIX_SM_LAST_ADV': 'Last advertisement click',
-            'PHPSESSID': 'PHP session ID',
-            'UID': 'User ID cookie'
-        }
+            report.append("   ❌ No Bitrix cookies found via Selenium")
         
-        print("\n3. Important Authentication Cookies:")
-        all_cookies_dict = {c['name']: c['value'] for c in selenium_cookies}
+        report.append("\n3. Important Authentication Cookies:")
+        # Case-insensitive name index, built once instead of per important cookie
+        names_by_upper = {name.upper(): name for name in all_cookies_dict}
         found_important = []
         
-        for cookie_name, description in important_cookies.items():
-            if cookie_name in all_cookies_dict:
-                value = all_cookies_dict[cookie_name]
+        for cookie_name, description in _IMPORTANT_COOKIES.items():
+            actual_name = cookie_name if cookie_name in all_cookies_dict else names_by_upper.get(cookie_name)
+            if actual_name:
+                value = all_cookies_dict[actual_name]
                 display_value = value[:30] + '...' if len(value) > 30 else value
-                print(f"   ✅ {cookie_name}: {display_value}")
-                print(f"     Description: {description}")
-                found_important.append(cookie_name)
-            elif cookie_name.lower() in [c.lower() for c in all_cookies_dict.keys()]:
-                # Case insensitive check
-                for actual_name in all_cookies_dict.keys():
-                    if actual_name.upper() == cookie_name:
-                        value = all_cookies_dict[actual_name]
-                        display_value = value[:30] + '...' if len(value) > 30 else value
-                        print(f"   ✅ {actual_name}: {display_value}")
-                        print(f"     Description: {description}")
-                        found_important.append(actual_name)
-                        break
+                report.append(f"   ✅ {actual_name}: {display_value}")
+                report.append(f"     Description: {description}")
+                found_important.append(actual_name)
             else:
-                print(f"   ❌ {cookie_name}: Not found")
+                report.append(f"   ❌ {cookie_name}: Not found")
         
         # Determine authentication status
-        has_bitrix_uidl = 'BITRIX_SM_UIDL' in found_important or any('BITRIX_SM_UIDL' in c.upper() for c in all_cookies_dict.keys())
-        has_php_sessid = 'PHPSESSID' in found_important or any('PHPSESSID' in c.upper() for c in all_cookies_dict.keys())
+        has_bitrix_uidl = 'BITRIX_SM_UIDL' in found_important or any('BITRIX_SM_UIDL' in name for name in names_by_upper)
+        has_php_sessid = 'PHPSESSID' in found_important or any('PHPSESSID' in name for name in names_by_upper)
         has_any_bitrix = len(bitrix_selenium) > 0 or len(bitrix_cookies) > 0
         
-        print("\n4. Authentication Status:")
+        report.append("\n4. Authentication Status:")
         if has_bitrix_uidl:
-            print("   ✅ STRONGLY AUTHENTICATED - BITRIX_SM_UIDL found")
-            print("   This is the main authentication cookie for Bitrix24")
+            report.append("   ✅ STRONGLY AUTHENTICATED - BITRIX_SM_UIDL found")
+            report.append("   This is the main authentication cookie for Bitrix24")
             auth_status = "authenticated"
         elif has_php_sessid and has_any_bitrix:
-            print("   ⚠️  PARTIALLY AUTHENTICATED - Session cookies found")
-            print("   May be logged in but missing primary auth cookie")
+            report.append("   ⚠️  PARTIALLY AUTHENTICATED - Session cookies found")
+            report.append("   May be logged in but missing primary auth cookie")
             auth_status = "partial"
         elif has_any_bitrix:
-            print("   ⚠️  POSSIBLY AUTHENTICATED - Some Bitrix cookies found")
-            print("   But missing key authentication cookies")
+            report.append("   ⚠️  POSSIBLY AUTHENTICATED - Some Bitrix cookies found")
+            report.append("   But missing key authentication cookies")
             auth_status = "possible"
         else:
-            print("   ❌ NOT AUTHENTICATED - No Bitrix cookies found")
+            report.append("   ❌ NOT AUTHENTICATED - No Bitrix cookies found")
             auth_status = "not_authenticated"
         
-        print("\n" + "="*60)
+        report.append("\n" + "="*60)
+        if verbose:
+            print("\n".join(report))
         return auth_status, {
             'bitrix_cookies': bitrix_cookies,
             'session_cookies': session_cookies,
-            'selenium_cookies': {c['name']: c['value'] for c in selenium_cookies},
+            'selenium_cookies': all_cookies_dict,
             'has_bitrix_uidl': has_bitrix_uidl,
             'has_php_sessid': has_php_sessid
         }
@@ -284,6 +623,30 @@ class ChromeAuthApp:
         print("BITRIX24 API TOKEN ACQUISITION")
         print("="*60)
         
+        # A persistent profile can still hold a live session from a previous run
+        print("\n0. Checking for an existing session...")
+        auth_status, cookie_info = self.check_bitrix_cookies(verbose=False)
+        reused_session = auth_status == "authenticated" and "login=yes" not in self.driver.current_url
+        
+        if reused_session:
+            print("   ✅ Auth cookie present, trying the existing session")
+        else:
+            self._login_interactively()
+        
+        token, user_id = self._acquire_token()
+        
+        if not token and reused_session:
+            # The profile kept BITRIX_SM_UIDL from a session the server no
+            # longer accepts; log in again instead of failing on every run
+            print("\n⚠️  Saved session looks expired, falling back to manual login")
+            self.driver.get(self.target_url)
+            self._login_interactively()
+            token, user_id = self._acquire_token()
+        
+        return token, user_id
+    
+    def _login_interactively(self):
+        """Steps 1-3: wait for the login page, the user's login and the auth cookies"""
         # Step 1: Watch for the target login URL
         print("\n1. Waiting for login page...")
         if not self.watch_for_target_url(timeout=300):
@@ -307,7 +670,9 @@ class ChromeAuthApp:
         if auth_status in ["not_authenticated", "possible"]:
             print(f"\n⚠️  Weak authentication detected: {auth_status}")
             print("Trying to proceed anyway...")
-        
+    
+    def _acquire_token(self):
+        """Steps 4-6: open the main page, read the CSRF token and request the API token"""
         # Step 4: Navigate to main page if needed
         current_url = self.driver.current_url
         if "desktop" not in current_url and "stream" not in current_url:
@@ -315,11 +680,18 @@ class ChromeAuthApp:
             main_url = "https://ugautodetal.ru/stream/"
             print(f"   Going to: {main_url}")
             self.driver.get(main_url)
-            time.sleep(5)
-        
-        # Step 5: Get CSRF token
+            # Wait for the CSRF token the next step needs rather than a fixed delay
+            try:
+                WebDriverWait(self.driver, 15).until(
+                    lambda driver: driver.execute_script(_CSRF_READY_JS)
+                )
+            except TimeoutException:
+                print("   ⚠️  CSRF token not visible yet, trying extraction anyway...")
+        
+        # Step 5: Get CSRF token (user ID comes back in the same round-trip)
         print("\n5. Extracting CSRF token...")
-        csrf_token, site_id = self.extract_csrf_token()
+        page_data = self.driver.execute_script(_PAGE_AUTH_JS) or {}
+        csrf_token, site_id = self.extract_csrf_token(page_data)
         
         if not csrf_token:
             print("❌ Failed to extract CSRF token")
@@ -327,7 +699,7 @@ class ChromeAuthApp:
         
         # Step 6: Get API token
         print("\n6. Getting API token...")
-        token, user_id = self.request_api_token(csrf_token, site_id)
+        token, user_id = self.request_api_token(csrf_token, site_id, page_data)
         
         if token:
             print(f"\n" + "="*60)
@@ -345,108 +717,18 @@ class ChromeAuthApp:
             print("❌ Failed to get API token")
             return None, None
     
-    def extract_csrf_token(self):
-        """Extract CSRF token and site ID from page"""
-        csrf_js = """
-        var csrf = document.querySelector('meta[name="x-bitrix-csrf-token"]');
-        var csrf_value = csrf ? csrf.getAttribute('content') : null;
-        
-        // Try to get from BX if meta tag not found
-        if (!csrf_value && typeof BX !== 'undefined' && typeof BX.message === 'function') {
-            csrf_value = BX.message('bitrix_sessid');
-        }
-        
-        // Try from window object
-        if (!csrf_value && typeof window.bitrix_sessid !== 'undefined') {
-            csrf_value = window.bitrix_sessid;
-        }
-        
-        // Try form input
-        if (!csrf_value) {
-            var form_csrf = document.querySelector('input[name="sessid"], input[name="csrf"], input[name="bitrix_sessid"]');
-            if (form_csrf) {
-                csrf_value = form_csrf.value;
-            }
-        }
-        
-        // Try from URL parameters
-        if (!csrf_value) {
-            var urlParams = new URLSearchParams(window.location.search);
-            csrf_value = urlParams.get('sessid') || urlParams.get('csrf') || urlParams.get('bitrix_sessid');
-        }
-        
-        // Try to find in page scripts
-        if (!csrf_value) {
-            var scripts = document.getElementsByTagName('script');
-            for (var i = 0; i < scripts.length; i++) {
-                var scriptContent = scripts[i].innerText;
-                if (scriptContent.includes('bitrix_sessid') && scriptContent.includes('=')) {
-                    var match = scriptContent.match(/bitrix_sessid['"]?\\s*[:=]\\s*['"]([^'"]+)['"]/i);
-                    if (match) {
-                        csrf_value = match[1];
-                        break;
-                    }
-                }
-            }
-        }
-        
-        // Get site ID
-        var site_id = 'ap'; // Default
-        var site_meta = document.querySelector('meta[name="x-bitrix-site-id"]');
-        if (site_meta) {
-            site_id = site_meta.getAttribute('content');
-        } else if (typeof BX !== 'undefined' && typeof BX.message === 'function') {
-            // Try to get from BX
-            var bx_site_id = BX.message('site_id') || BX.message('SITE_ID');
-            if (bx_site_id) {
-                site_id = bx_site_id;
-            }
-        }
-        
-        console.log('CSRF Token:', csrf_value ? csrf_value.substring(0, 30) + '...' : 'Not found');
-        console.log('Site ID:', site_id);
-        
-        return {
-            csrf: csrf_value,
-            site_id: site_id
-        };
+    def extract_csrf_token(self, page_data=None):
         """
+        Extract CSRF token and site ID from page
         
-        csrf_data = self.driver.execute_script(csrf_js)
+        Args:
+            page_data: Result of _PAGE_AUTH_JS if already fetched; the page is
+                queried only when this is None
+        """
+        csrf_data = page_data if page_data is not None else self.driver.execute_script(_CSRF_JS) or {}
         csrf_token = csrf_data.get('csrf')
         site_id = csrf_data.get('site_id', 'ap')
         
-        if not csrf_token:
-            print("   ⚠️  CSRF token not found in meta tags, trying alternative methods...")
-            
-            # Last attempt: extract from any script tag
-            last_csrf_attempt = """
-            // Search through all script content for bitrix_sessid
-            var scripts = document.getElementsByTagName('script');
-            for (var i = 0; i < scripts.length; i++) {
-                var content = scripts[i].innerHTML;
-                // Look for bitrix_sessid in various formats
-                var patterns = [
-                    /bitrix_sessid['"]?\\s*[:=]\\s*['"]([a-f0-9]+)['"]/i,
-                    /sessid['"]?\\s*[:=]\\s*['"]([a-f0-9]+)['"]/i,
-                    /csrf['"]?\\s*[:=]\\s*['"]([a-f0-9]+)['"]/i,
-                    /"bitrix_sessid":"([a-f0-9]+)"/i,
-                    /'bitrix_sessid':'([a-f0-9]+)'/i
-                ];
-                
-                for (var j = 0; j < patterns.length; j++) {
-                    var match = content.match(patterns[j]);
-                    if (match && match[1]) {
-                        return {csrf: match[1], site_id: 'ap'};
-                    }
-                }
-            }
-            return {csrf: null, site_id: 'ap'};
-            """
-            
-            result = self.driver.execute_script(last_csrf_attempt)
-            csrf_token = result.get('csrf')
-        
         if csrf_token:
             print(f"   ✅ CSRF Token: {csrf_token[:30]}...")
             print(f"   ✅ Site ID: {site_id}")
@@ -455,60 +737,39 @@ class ChromeAuthApp:
             print("   ❌ Could not find CSRF token")
             return None, None
     
-    def request_api_token(self, csrf_token, site_id):
-        """Request API token using CSRF token"""
-        # First, try to get existing token
-        print("   Trying to get existing API token...")
-        
-        token_request_js = """
-        var csrf = arguments[0];
-        var site_id = arguments[1];
-        
-        var url = '/bitrix/services/main/ajax.php?action=me%3Abase.api.user.getTokenApi';
-        
-        console.log('%c📤 SENDING GET TOKEN REQUEST', 'color: blue; font-weight: bold');
-        console.log('URL:', url);
-        console.log('CSRF:', csrf ? csrf.substring(0, 30) + '...' : 'null');
-        console.log('Site ID:', site_id);
-        
-        var xhr = new XMLHttpRequest();
-        xhr.withCredentials = true;
-        
-        xhr.onreadystatechange = function() {
-            if (xhr.readyState === 4) {
-                console.log('%c✅ RESPONSE RECEIVED', 'color: green; font-weight: bold');
-                console.log('Status:', xhr.status);
-                console.log('Response:', xhr.responseText);
-                try {
-                    var data = JSON.parse(xhr.responseText);
-                    window.tokenResponse = data;
-                } catch(e) {
-                    console.error('Parse error:', e);
-                    window.tokenResponse = {error: 'Parse error', raw: xhr.responseText};
-                }
-            }
-        };
-        
-        xhr.onerror = function() {
-            console.error('%c❌ REQUEST ERROR', 'color: red; font-weight: bold');
-            window.tokenResponse = {error: xhr.statusText || 'Network error'};
-        };
-        
-        xhr.open('POST', url, false);
-        xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
-        xhr.setRequestHeader('x-bitrix-csrf-token', csrf);
-        xhr.setRequestHeader('x-bitrix-site-id', site_id);
-        xhr.setRequestHeader('bx-ajax', 'true');
-        xhr.send('');
+    def _get_or_create_token(self, csrf_token, site_id, create_body):
+        """
+        Run getTokenApi, then createTokenApi if needed, in one browser call
         
-        return 'Get token request sent';
+        Returns {'existing': ..., 'created': ...} with the parsed replies;
+        'created' is only present when the existing-token lookup came back
+        without a token.
         """
+        try:
+            return self.driver.execute_async_script(_GET_OR_CREATE_TOKEN_JS, csrf_token, site_id, create_body) or {}
+        except TimeoutException:
+            return {'existing': {'error': 'No response within the script timeout'}}
+    
+    def request_api_token(self, csrf_token, site_id, page_data=None):
+        """
+        Request API token using CSRF token
         
-        self.driver.execute_script(token_request_js, csrf_token, site_id)
-        time.sleep(3)
+        Args:
+            csrf_token: Bitrix session CSRF token
+            site_id: Bitrix site ID
+            page_data: Result of _PAGE_AUTH_JS, used for the user ID fallback
+        """
+        # First, try to get existing token; the browser creates one right away
+        # if none exists, without another round-trip through Python
+        print("   Trying to get existing API token...")
         
-        response_js = "return window.tokenResponse;"
-        result = self.driver.execute_script(response_js)
+        # Request body with permissions
+        create_body = (
+            f"name=Python-API-Client-{int(time.time() * 1000)}&expires_in_days=365"
+            "&permissions[]=user&permissions[]=crm&permissions[]=im&permissions[]=entity&permissions[]=task"
+        )
+        replies = self._get_or_create_token(csrf_token, site_id, create_body)
+        result = replies.get('existing')
         
         token = None
         user_id = None
@@ -529,57 +790,7 @@ class ChromeAuthApp:
         # If no existing token, create new one
         if not token:
             print("   No existing token found. Creating new token...")
-            time.sleep(2)
-            
-            create_request_js = """
-            var csrf = arguments[0];
-            var site_id = arguments[1];
-            
-            var url = '/bitrix/services/main/ajax.php?action=me%3Abase.api.user.createTokenApi';
-            
-            console.log('%c📤 CREATING NEW TOKEN', 'color: blue; font-weight: bold');
-            console.log('URL:', url);
-            
-            // Request body with permissions
-            var body = 'name=Python-API-Client-' + Date.now() + '&expires_in_days=365&permissions[]=user&permissions[]=crm&permissions[]=im&permissions[]=entity&permissions[]=task';
-            
-            var xhr = new XMLHttpRequest();
-            xhr.withCredentials = true;
-            
-            xhr.onreadystatechange = function() {
-                if (xhr.readyState === 4) {
-                    console.log('%c✅ CREATE RESPONSE RECEIVED', 'color: green; font-weight: bold');
-                    console.log('Status:', xhr.status);
-                    console.log('Response:', xhr.responseText);
-                    try {
-                        var data = JSON.parse(xhr.responseText);
-                        window.tokenResponse = data;
-                    } catch(e) {
-                        console.error('Parse error:', e);
-                        window.tokenResponse = {error: 'Parse error', raw: xhr.responseText};
-                    }
-                }
-            };
-            
-            xhr.onerror = function() {
-                console.error('%c❌ REQUEST ERROR', 'color: red; font-weight: bold');
-                window.tokenResponse = {error: xhr.statusText || 'Network error'};
-            };
-            
-            xhr.open('POST', url, false);
-            xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
-            xhr.setRequestHeader('x-bitrix-csrf-token', csrf);
-            xhr.setRequestHeader('x-bitrix-site-id', site_id);
-            xhr.setRequestHeader('bx-ajax', 'true');
-            xhr.send(body);
-            
-            return 'Create token request sent';
-            """
-            
-            self.driver.execute_script(create_request_js, csrf_token, site_id)
-            time.sleep(3)
-            
-            result = self.driver.execute_script(response_js)
+            result = replies.get('created')
             
             if result and result.get('status') == 'success' and result.get('data'):
                 data = result['data']
@@ -604,109 +815,22 @@ class ChromeAuthApp:
         
         # Get user_id if not obtained
         if not user_id and token:
-            user_id = self.extract_user_id()
+            user_id = self.extract_user_id(page_data)
         
         return token, user_id
     
-    def extract_user_id(self):
-        """Extract user ID from page"""
-        user_id_js = """
-        var user_id = null;
-        
-        // Method 1: BX API (most reliable)
-        if (typeof BX !== 'undefined' && typeof BX.User !== 'undefined') {
-            if (typeof BX.User.getId === 'function') {
-                user_id = BX.User.getId();
-                console.log('User ID from BX.User.getId:', user_id);
-            }
-        }
-        
-        // Method 2: Global BX object
-        if (!user_id && typeof BX !== 'undefined') {
-            if (BX.user_id) {
-                user_id = BX.user_id;
-                console.log('User ID from BX.user_id:', user_id);
-            } else if (BX.userId) {
-                user_id = BX.userId;
-                console.log('User ID from BX.userId:', user_id);
-            }
-        }
-        
-        // Method 3: Cookies
-        if (!user_id) {
-            var cookies = document.cookie.split(';');
-            for (var i = 0; i < cookies.length; i++) {
-                var cookie = cookies[i].trim();
-                if (cookie.indexOf('UID=') === 0) {
-                    var uid = cookie.substring('UID='.length);
-                    if (uid && !isNaN(parseInt(uid))) {
-                        user_id = parseInt(uid);
-                        console.log('User ID from UID cookie:', user_id);
-                        break;
-                    }
-                }
-                if (cookie.indexOf('USER_ID=') === 0) {
-                    var uid = cookie.substring('USER_ID='.length);
-                    if (uid && !isNaN(parseInt(uid))) {
-                        user_id = parseInt(uid);
-                        console.log('User ID from USER_ID cookie:', user_id);
-                        break;
-                    }
-                }
-                if (cookie.indexOf('BITRIX_SM_UID=') === 0) {
-                    var uid = cookie.substring('BITRIX_SM_UID='.length);
-                    if (uid && !isNaN(parseInt(uid))) {
-                        user_id = parseInt(uid);
-                        console.log('User ID from BITRIX_SM_UID cookie:', user_id);
-                        break;
-                    }
-                }
-            }
-        }
-        
-        // Method 4: Page elements
-        if (!user_id) {
-            var selectors = [
-                '[data-user-id]',
-                '[data-uid]',
-                '[data-id]',
-                '.user-id',
-                '.user_id',
-                '#user_id',
-                '#userId'
-            ];
-            
-            for (var j = 0; j < selectors.length; j++) {
-                var elem = document.querySelector(selectors[j]);
-                if (elem) {
-                    var uid = elem.getAttribute('data-user-id') || 
-                              elem.getAttribute('data-uid') || 
-                              elem.getAttribute('data-id') ||
-                              elem.getAttribute('value') ||
-                              elem.textContent;
-                    
-                    if (uid) {
-                        var match = uid.toString().match(/(\\d+)/);
-                        if (match) {
-                            user_id = parseInt(match[1]);
-                            console.log('User ID from element (' + selectors[j] + '):', user_id);
-                            break;
-                        }
-                    }
-                }
-            }
-        }
-        
-        // Method 5: Default to 1
-        if (!user_id) {
-            user_id = 1;
-            console.log('User ID defaulting to:', user_id);
-        }
-        
-        return user_id;
+    def extract_user_id(self, page_data=None):
         """
+        Extract user ID from page
         
-        user_id = self.driver.execute_script(user_id_js)
+        Args:
+            page_data: Result of _PAGE_AUTH_JS if already fetched; the page is
+                queried only when this is None
+        """
+        if page_data is not None and page_data.get('user_id'):
+            user_id = page_data['user_id']
+        else:
+            user_id = self.driver.execute_script(_USER_ID_JS)
         print(f"   ✅ User ID: {user_id}")
         return user_id
     
@@ -723,8 +847,7 @@ class ChromeAuthApp:
                 'url': self.driver.current_url
             }
             
-            with open('bitrix_token.json', 'w') as f:
-                json.dump(token_data, f, indent=2)
+            write_file_atomic('bitrix_token.json', json.dumps(token_data, indent=2).encode('utf-8'))
             
             print(f"   💾 Token saved to bitrix_token.json")
             return True
@@ -732,68 +855,103 @@ class ChromeAuthApp:
             print(f"   ⚠️  Could not save token to file: {e}")
             return False
     
+    def _page_cookies(self):
+        """
+        Cookies for the current page, including HttpOnly ones
+        
+        Reads them with the CDP Network.getCookies command, which chromedriver
+        forwards as-is, and falls back to WebDriver get_cookies() if CDP is
+        unavailable. Only name and value are guaranteed to be present.
+        """
+        try:
+            return self.driver.execute_cdp_cmd('Network.getCookies', {})['cookies']
+        except (WebDriverException, AttributeError, KeyError):
+            return self.driver.get_cookies()
+    
     def get_cookies(self):
         """Get all cookies from browser"""
-        cookies = self.driver.get_cookies()
-        return {cookie['name']: cookie['value'] for cookie in cookies}
+        return {cookie['name']: cookie['value'] for cookie in self._page_cookies()}
     
     def get_local_storage(self):
         """Get local storage data"""
-        return self.driver.execute_script("""
-            var items = {};
-            for (var i = 0; i < localStorage.length; i++) {
-                var key = localStorage.key(i);
-                items[key] = localStorage.getItem(key);
-            }
-            return items;
-        """)
+        return self.driver.execute_script(_LOCAL_STORAGE_JS)
     
     def get_session_storage(self):
         """Get session storage data"""
-        return self.driver.execute_script("""
-            var items = {};
-            for (var i = 0; i < sessionStorage.length; i++) {
-                var key = sessionStorage.key(i);
-                items[key] = sessionStorage.getItem(key);
-            }
-            return items;
-        """)
+        return self.driver.execute_script(_SESSION_STORAGE_JS)
     
-    def auto_login_with_saved_cookies(self, url, cookies_file='cookies.pkl'):
+    def get_page_state(self):
+        """Get local storage, session storage, URL and title in one call"""
+        return self.driver.execute_script(_PAGE_STATE_JS)
+    
+    def auto_login_with_saved_cookies(self, url, cookies_file='cookies.json'):
         """Auto login with saved cookies"""
-        if not os.path.exists(cookies_file):
-            return False
-        
-        self.driver.get(url)
-        
         try:
-            with open(cookies_file, 'rb') as f:
-                cookies = pickle.load(f)
-            
-            for cookie in cookies:
-                try:
-                    if 'expiry' in cookie:
-                        del cookie['expiry']
-                    self.driver.add_cookie(cookie)
-                except Exception as e:
-                    print(f"   ⚠️  Could not add cookie {cookie.get('name', 'unknown')}: {e}")
-                    continue
-            
-            self.driver.refresh()
-            time.sleep(3)
+            cookies = self.load_cookies_json(cookies_file)
+            if not cookies:
+                return False
+            
+            # CDP can set every cookie in one call before the first page load;
+            # otherwise add them one by one on the site and reload
+            cookies_set = self._set_cookies_cdp(cookies, url)
+            self.driver.get(url)
+            
+            if not cookies_set:
+                for cookie in cookies:
+                    try:
+                        if 'expiry' in cookie:
+                            del cookie['expiry']
+                        self.driver.add_cookie(cookie)
+                    except Exception as e:
+                        print(f"   ⚠️  Could not add cookie {cookie.get('name', 'unknown')}: {e}")
+                        continue
+                
+                self.driver.refresh()
+            self.wait_for_page_ready()
             
             return True
         except Exception as e:
             print(f"   ❌ Error loading cookies: {e}")
             return False
     
-    def save_cookies(self, filename='cookies.pkl'):
-        """Save current cookies to file"""
+    def _set_cookies_cdp(self, cookies, url):
+        """
+        Set saved WebDriver cookies with a single CDP Network.setCookies call
+        
+        Cookies are set without an expiry, as the add_cookie path does, and
+        cookies without a domain are bound to `url`. Returns False if CDP is
+        unavailable or rejects the batch.
+        """
+        params = []
+        for cookie in cookies:
+            param = {key: cookie[key] for key in _CDP_COOKIE_FIELDS if key in cookie}
+            if 'domain' not in param:
+                param['url'] = url
+            params.append(param)
+        
+        try:
+            self.driver.execute_cdp_cmd('Network.setCookies', {'cookies': params})
+            return True
+        except (WebDriverException, AttributeError):
+            return False
+    
+    def save_cookies_json(self, filename='cookies.json'):
+        """Save current cookies to JSON file"""
         cookies = self.driver.get_cookies()
-        with open(filename, 'wb') as f:
-            pickle.dump(cookies, f)
+        write_file_atomic(filename, _dumps(cookies))
         print(f"Cookies saved to {filename}")
     
+    def load_cookies_json(self, filename='cookies.json'):
+        """
+        Load cookies saved by save_cookies_json
+        Legacy cookies.pkl files are never unpickled; the user logs in again
+        """
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                return _loads(f.read())
+        
+        return None
+    
     def close(self):
         """Close browser"""
         self.driver.quit()
@@ -821,7 +979,7 @@ if __name__ == "__main__":
             print(f"   User ID: {user_id}")
             
             # Save cookies for future use
-            app.save_cookies()
+            app.save_cookies_json()
             
             print(f"\nYou can now use this token for API calls.")
             print(f"The token has been saved to 'bitrix_token.json'")
@@ -845,9 +1003,8 @@ if __name__ == "__main__":
         print("="*60)
         
         try:
-            # Keep browser open
-            while True:
-                time.sleep(1)
+            # Keep browser open; block until Ctrl+C without waking up periodically
+            threading.Event().wait()
         except KeyboardInterrupt:
             print("\nClosing browser...")
             app.close()
\ No newline at end of file
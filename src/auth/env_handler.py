@@ -4,83 +4,209 @@ Environment variable handler
 
 import os
 import json
-from typing import Dict, List, Optional
+import mmap
+import stat
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-def load_env_file(filename='.env') -> Dict[str, str]:
-    """Load environment variables from .env file"""
-    if not os.path.exists(filename):
-        return {}
+# Byte lookup table for whitespace skipped around keys and values
+_WHITESPACE = b' \t\r\f\v'
+_IS_SPACE = bytearray(256)
+for _byte in _WHITESPACE:
+    _IS_SPACE[_byte] = 1
+
+_MMAP_MIN_SIZE = 4096
+
+def _scan_env(data):
+    """
+    Yield (key, value) pairs from .env content in bytes or an mmap,
+    using find() and decoding only the key/value slices
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        newline = data.find(b'\n', pos)
+        if newline == -1:
+            newline = end
+        
+        start = pos
+        while start < newline and _IS_SPACE[data[start]]:
+            start += 1
+        pos = newline + 1
+        
+        if start == newline or data[start] == 0x23:  # blank line or '#'
+            continue
+        
+        equals = data.find(b'=', start, newline)
+        if equals == -1:
+            continue
+        
+        # Only trim when an edge byte is whitespace (rare in .env files)
+        key_end = equals
+        while key_end > start and _IS_SPACE[data[key_end - 1]]:
+            key_end -= 1
+        if key_end == start:  # '=value' with no key
+            continue
+        
+        value_start = equals + 1
+        value_end = newline
+        while value_start < value_end and _IS_SPACE[data[value_start]]:
+            value_start += 1
+        while value_end > value_start and _IS_SPACE[data[value_end - 1]]:
+            value_end -= 1
+        
+        yield data[start:key_end].decode('utf-8'), data[value_start:value_end].decode('utf-8')
+
+def iter_env_file(filename='.env') -> Iterator[Tuple[str, str]]:
+    """Yield (key, value) pairs from a .env file without building a dict"""
+    try:
+        f = open(filename, 'rb')
+    except FileNotFoundError:
+        return
+    
+    # Large files are scanned straight from an mmap to skip the read copy
+    with f:
+        if os.fstat(f.fileno()).st_size < _MMAP_MIN_SIZE:
+            data = f.read()
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    try:
+        yield from _scan_env(data)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+def load_env_file(filename='.env', apply: bool = False,
+                  return_dict: bool = True) -> Union[Dict[str, str], int]:
+    """
+    Load environment variables from .env file
+    
+    Args:
+        filename: Path to the .env file
+        apply: Also export every entry into os.environ while scanning
+        return_dict: With apply, set False to skip building the dict and
+                     get the number of applied entries instead
+    """
+    if not apply:
+        return dict(iter_env_file(filename))
     
     env_vars = {}
-    with open(filename, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith('#') and '=' in line:
-                key, value = line.split('=', 1)
-                env_vars[key.strip()] = value.strip()
+    count = 0
+    for key, value in iter_env_file(filename):
+        os.environ[key] = value
+        count += 1
+        if return_dict:
+            env_vars[key] = value
     
-    return env_vars
+    return env_vars if return_dict else count
 
-def save_env_file(env_vars: Dict[str, str], filename='.env') -> List[str]:
-    """Save environment variables to .env file"""
-    lines = []
-    for key, value in env_vars.items():
-        lines.append(f"{key}={value}")
+def write_file_atomic(filename, data: bytes):
+    """
+    Write bytes to a file through a temporary sibling and os.replace,
+    so readers never see a half-written file if the process is interrupted
+    
+    These files hold tokens and cookies: the temporary file is created
+    owner-only and ends up with the mode of the file it replaces (0600 for
+    a new file).
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        mode = 0o600
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+    tmp_name = f"{filename}.tmp"
+    try:
+        # A leftover from an interrupted write may have looser permissions
+        os.unlink(tmp_name)
+    except FileNotFoundError:
+        pass
     
+    data = memoryview(data)
+    fd = os.open(tmp_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+    os.chmod(tmp_name, mode)
+    os.replace(tmp_name, filename)
+
+def _write_env_lines(lines: Iterable[str], filename='.env'):
+    """Write KEY=value lines to an env file in one atomic swap"""
+    write_file_atomic(filename, '\n'.join(lines).encode('utf-8'))
+
+def save_env_file(env_vars: Dict[str, str], filename='.env') -> List[str]:
+    """Save environment variables to .env file"""
+    lines = [f"{key}={value}" for key, value in env_vars.items()]
+    _write_env_lines(lines, filename)
     return lines
 
 def get_env_var(key: str, default: str = None) -> Optional[str]:
     """Get environment variable with fallback"""
+    # Read os.environ every time: it is already a dict, and a memo would
+    # miss values set later by load_dotenv, the auth flow or os.environ
     return os.environ.get(key, default)
 
 def set_env_var(key: str, value: str):
     """Set environment variable"""
+    # Skip putenv when the value is already current
+    if os.environ.get(key) == value:
+        return
     os.environ[key] = value
 
-def create_env_file_from_auth(auth_data: Dict) -> List[str]:
-    """Create .env file from authentication data"""
+# .env key -> candidate paths into the auth data, first non-empty value wins
+_AUTH_SPEC = (
+    ("USER_ID", (("user_id",),)),
+    ("PULL_CHANNEL_PRIVATE", (("pull_config", "channels", "private", "id"),)),
+    ("PULL_CHANNEL_SHARED", (("pull_config", "channels", "shared", "id"),)),
+    ("PULL_WEBSOCKET_URL", (("pull_config", "server", "websocket_secure"),
+                            ("pull_config", "server", "websocket"))),
+)
+
+def _dig(data, path):
+    """Follow a key path through nested dicts, None if any step is missing"""
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+@lru_cache(maxsize=256)
+def _upper(name: str) -> str:
+    # Cookie names repeat across auth refreshes (PHPSESSID, BITRIX_SM_*)
+    return name.upper()
+
+def create_env_file_from_auth(auth_data: Dict, verbose: bool = True,
+                              filename='.env') -> List[str]:
+    """
+    Create .env file from authentication data
+    
+    Args:
+        auth_data: Captured authentication data
+        verbose: Print a summary line (disable for automated refreshes)
+        filename: Target env file
+    """
     env_lines = []
     
     # Add cookies
     cookies = auth_data.get('cookies', {})
-    for cookie_name, cookie_value in cookies.items():
-        env_lines.append(f"COOKIE_{cookie_name.upper()}={cookie_value}")
-    
-    # Add user ID
-    user_id = auth_data.get('user_id')
-    if user_id:
-        env_lines.append(f"USER_ID={user_id}")
+    env_lines.extend(f"COOKIE_{_upper(name)}={value}" for name, value in cookies.items())
     
     # Add important tokens
     env_lines.append("CSRF_BITRIX_SESSID=placeholder")  # Will be extracted dynamically
     
-    # Add Pull config if available
-    pull_config = auth_data.get('pull_config', {})
-    if pull_config:
-        # Add channel IDs
-        channels = pull_config.get('channels', {})
-        if 'private' in channels:
-            channel_id = channels['private'].get('id')
-            if channel_id:
-                env_lines.append(f"PULL_CHANNEL_PRIVATE={channel_id}")
-        
-        if 'shared' in channels:
-            channel_id = channels['shared'].get('id')
-            if channel_id:
-                env_lines.append(f"PULL_CHANNEL_SHARED={channel_id}")
-        
-        # Add server config
-        server = pull_config.get('server', {})
-        websocket_url = server.get('websocket_secure') or server.get('websocket')
-        if websocket_url:
-            env_lines.append(f"PULL_WEBSOCKET_URL={websocket_url}")
+    # Add user ID and Pull config values that are present
+    for env_key, paths in _AUTH_SPEC:
+        for path in paths:
+            value = _dig(auth_data, path)
+            if value:
+                env_lines.append(f"{env_key}={value}")
+                break
     
     # Write to .env file
-    with open('.env', 'w', encoding='utf-8') as f:
-        f.write('\n'.join(env_lines))
+    _write_env_lines(env_lines, filename)
     
-    print(f"✓ Created .env file with {len(env_lines)} entries")
+    if verbose:
+        print(f"✓ Created .env file with {len(env_lines)} entries")
     return env_lines
\ No newline at end of file
@@ -14,17 +14,17 @@ class TelegramChatListItem(QWidget):
     
     clicked = pyqtSignal(int)
     
-    def __init__(self, group: Group, current_user: User, customers: list, is_dark=False):
+    def __init__(self, group: Group, current_user: User, customers_by_id: dict, is_dark=False):
         super().__init__()
         self.group_id = group.id
         self.group = group
         self.is_dark = is_dark
         self.colors = get_theme_colors(is_dark)
         
-        self.setup_ui(group, current_user, customers)
+        self.setup_ui(group, current_user, customers_by_id)
         self.apply_style()
     
-    def setup_ui(self, group: Group, current_user: User, customers: list):
+    def setup_ui(self, group: Group, current_user: User, customers_by_id: dict):
         layout = QHBoxLayout(self)
         layout.setContentsMargins(12, 8, 12, 8)
         layout.setSpacing(12)
@@ -44,7 +44,7 @@ class TelegramChatListItem(QWidget):
         """)
         
         # Get first letter of chat title
-        title = group.display_title(current_user, customers)
+        title = group.display_title(current_user, customers_by_id)
         if title:
             letter = title[0].upper()
         else:
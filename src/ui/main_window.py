@@ -62,6 +62,7 @@ class TelegramChatWindow(QMainWindow):
         # Data storage
         self.current_user = None
         self.customers = []
+        self.customers_by_id = {}
         self.managers = []
         self.groups = []
         self.current_group = None
@@ -652,13 +653,21 @@ class TelegramChatWindow(QMainWindow):
         """Initialize all data"""
         print("Initializing data...")
         
+        # Fetch independent lists concurrently
+        profile, customers, managers, groups = self.api.fetch_many([
+            self.api.get_current_profile,
+            self.api.get_customers,
+            self.api.list_managers,
+            self.api.get_groups
+        ])
+        
         # Load user data
-        self.load_current_user()
+        self.load_current_user(profile)
         
         # Load other data
-        self.load_customers()
-        self.load_managers()
-        self.load_groups()
+        self.load_customers(customers)
+        self.load_managers(managers)
+        self.load_groups(groups)
         
         # Initialize Pull client
         self.initialize_pull_client()
@@ -666,12 +675,13 @@ class TelegramChatWindow(QMainWindow):
         # Update UI
         self.update_user_info()
     
-    def load_current_user(self):
+    def load_current_user(self, data=None):
         """Load current user profile"""
         print("Loading current user...")
         
         try:
-            data = self.api.get_current_profile()
+            if data is None:
+                data = self.api.get_current_profile()
             
             if data and not data.get("error"):
                 # Handle different response formats
@@ -715,12 +725,13 @@ class TelegramChatWindow(QMainWindow):
                 is_moderator=False
             )
     
-    def load_customers(self):
+    def load_customers(self, data=None):
         """Load customers list"""
         print("Loading customers...")
         
         try:
-            data = self.api.get_customers()
+            if data is None:
+                data = self.api.get_customers()
             
             if data and not data.get("error"):
                 # Handle different response formats
@@ -754,6 +765,7 @@ class TelegramChatWindow(QMainWindow):
                     )
                     self.customers.append(customer_obj)
                 
+                self.customers_by_id = {c.id: c for c in self.customers}
                 print(f"✓ Loaded {len(self.customers)} customers")
                 
                 # Show sample
@@ -777,14 +789,16 @@ class TelegramChatWindow(QMainWindow):
             Customer(id=1001, xml_id="USER_1001", name="Иван", last_name="Иванов"),
             Customer(id=1002, xml_id="USER_1002", name="Петр", last_name="Петров"),
         ]
+        self.customers_by_id = {c.id: c for c in self.customers}
         print(f"✓ Loaded {len(self.customers)} mock customers")
     
-    def load_managers(self):
+    def load_managers(self, data=None):
         """Load managers list"""
         print("Loading managers...")
         
         try:
-            data = self.api.list_managers()
+            if data is None:
+                data = self.api.list_managers()
             
             if data and not data.get("error"):
                 result = data.get("result", [])
@@ -817,12 +831,13 @@ class TelegramChatWindow(QMainWindow):
         ]
         print(f"✓ Loaded {len(self.managers)} mock managers")
     
-    def load_groups(self):
+    def load_groups(self, data=None):
         """Load chat groups"""
         print("Loading chat groups...")
         
         try:
-            data = self.api.get_groups()
+            if data is None:
+                data = self.api.get_groups()
             
             if data and not data.get("error"):
                 # Handle different response formats
@@ -961,19 +976,12 @@ class TelegramChatWindow(QMainWindow):
         """Load messages for a group"""
         print(f"Loading messages for group {group_id}...")
         
-        # Clear notifications
-        if group_id != 0:
-            try:
-                self.api.clear_notifications(group_id)
-            except:
-                pass
-        
-        # Load messages
+        # Load messages (clearing notifications in the same request)
         try:
             if group_id == 0:
                 data = self.api.get_user_news_content()
             else:
-                data = self.api.get_messages(group_id)
+                data = self.api.read_messages(group_id)
             
             self.messages = []
             
@@ -1228,11 +1236,11 @@ class TelegramChatWindow(QMainWindow):
             # Skip if filtered by search
             if hasattr(self, 'search_filter') and self.search_filter:
                 search_lower = self.search_filter.lower()
-                title = group.display_title(self.current_user, self.customers).lower()
+                title = group.display_title(self.current_user, self.customers_by_id).lower()
                 if search_lower not in title:
                     continue
             
-            item = TelegramChatListItem(group, self.current_user, self.customers, self.is_dark_mode)
+            item = TelegramChatListItem(group, self.current_user, self.customers_by_id, self.is_dark_mode)
             item.clicked.connect(self.select_chat)
             self.chats_layout.insertWidget(0, item)
     
@@ -1296,7 +1304,7 @@ class TelegramChatWindow(QMainWindow):
                 self.current_group = group
                 
                 # Update chat header
-                self.chat_title_label.setText(group.display_title(self.current_user, self.customers))
+                self.chat_title_label.setText(group.display_title(self.current_user, self.customers_by_id))
                 
                 # Update chat status
                 member_count = len(group.participants)
@@ -1483,9 +1491,9 @@ class TelegramChatWindow(QMainWindow):
             return f"Пользователь {user_id}"
         
         # Check customers
-        for customer in self.customers:
-            if customer.id == user_id_int:
-                return customer.full_name
+        customer = self.customers_by_id.get(user_id_int)
+        if customer:
+            return customer.full_name
         
         # Check managers
         for manager in self.managers:
@@ -1580,6 +1588,7 @@ class TelegramChatWindow(QMainWindow):
                 print(f"✓ New message in background chat {group_id_int}")
             
             # Refresh groups list
+            self.api.invalidate_cache("uad.shop.api.chat.")
             QTimer.singleShot(1000, self.refresh_groups)
             
         except Exception as e:
@@ -1628,7 +1637,7 @@ class TelegramChatWindow(QMainWindow):
             group_title = f"Чат {group_id}"
             for group in self.groups:
                 if group.id == int(group_id):
-                    group_title = group.display_title(self.current_user, self.customers)
+                    group_title = group.display_title(self.current_user, self.customers_by_id)
                     break
             
             # Show in status bar
@@ -1640,7 +1649,7 @@ class TelegramChatWindow(QMainWindow):
     def refresh_groups(self):
         """Refresh groups list"""
         if not self.search_filter:
-            self.load_groups()
+            self.load_groups(self.api.get_groups())
     
     def refresh_current_messages(self):
         """Refresh messages for current chat"""
@@ -1715,6 +1724,7 @@ class TelegramChatWindow(QMainWindow):
         self.statusBar().showMessage("Обновление данных...", 3000)
         
         # Refresh data
+        self.api.invalidate_cache()
         self.load_groups()
         if self.current_group:
             self.load_messages(self.current_group.id)